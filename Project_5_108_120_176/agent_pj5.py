@@ -0,0 +1,215 @@
+# Synthetic SNMPv2c agent for benchmarks and local development.
+#
+# Every simulated device answers on its own UDP port with sysDescr,
+# sysUpTime, sysName, the ifTable columns the collector reads, the IP/UDP/TCP
+# scalars and UCD memory. Interface octet counters follow a daily traffic
+# curve, so rates look like real traffic and Counter32 wraps happen on the
+# fast links. Counters depend only on the time, so any poller sees a
+# consistent series.
+import argparse
+import bisect
+import math
+import multiprocessing
+import random
+import selectors
+import socket
+import time
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_BASE_PORT = 16100
+DEFAULT_DEVICES = 10
+DEFAULT_INTERFACES = 8
+DEFAULT_COMMUNITY = "public"
+
+# Every n-th interface is reported down
+DOWN_EVERY = 8
+
+# Traffic per interface varies by this much over a day around its mean
+DAILY_SWING = 0.5
+DAY = 86400
+
+v2c = api.protoModules[api.protoVersion2c]
+
+IF_TABLE = (1, 3, 6, 1, 2, 1, 2, 2, 1)
+
+
+def oid(text):
+    return tuple(int(part) for part in text.split("."))
+
+
+# Function to count octets sent at `mean` bytes/s from `booted` to `now`
+def octets(mean, booted, now):
+    """Integral of mean * (1 + DAILY_SWING * sin(2*pi*t/DAY)) over [booted, now]."""
+    w = 2 * math.pi / DAY
+    return mean * ((now - booted) - DAILY_SWING / w * (math.cos(w * now) - math.cos(w * booted)))
+
+
+class SyntheticDevice:
+    """
+    One simulated agent: a sorted OID table whose values are computed on
+    read. `table` maps each OID to (SNMP type name, function of the time).
+    """
+
+    def __init__(self, index, interfaces, booted=None):
+        self.index = index
+        self.booted = time.time() if booted is None else booted
+        rng = random.Random(index)
+        table = {
+            oid("1.3.6.1.2.1.1.1.0"): ("OctetString", lambda now: "Linux synthetic 5.15.0 x86_64"),
+            oid("1.3.6.1.2.1.1.3.0"): ("TimeTicks", lambda now: int((now - self.booted) * 100) % 2 ** 32),
+            oid("1.3.6.1.2.1.1.5.0"): ("OctetString", lambda now: f"synthetic-{index}"),
+            oid("1.3.6.1.2.1.2.1.0"): ("Integer", lambda now: interfaces),
+            oid("1.3.6.1.2.1.31.1.5.0"): ("TimeTicks", lambda now: 0),
+            oid("1.3.6.1.2.1.6.9.0"): ("Gauge32", lambda now: 40 + int(20 * math.sin(now / 300))),
+            oid("1.3.6.1.4.1.2021.4.5.0"): ("Integer", lambda now: 8 * 1024 * 1024),
+            oid("1.3.6.1.4.1.2021.4.6.0"): ("Integer", lambda now: int(2 * 1024 * 1024 * (1 + math.sin(now / 600)))),
+        }
+        for scalar, mean in (("1.3.6.1.2.1.4.3.0", 2000), ("1.3.6.1.2.1.7.4.0", 300), ("1.3.6.1.2.1.4.5.0", 0.01)):
+            table[oid(scalar)] = self._counter(mean * rng.uniform(0.5, 1.5))
+
+        for if_index in range(1, interfaces + 1):
+            up = if_index % DOWN_EVERY != 0
+            # Link speeds from 10 Mbit/s to 10 Gbit/s, mostly lightly used
+            mean = rng.choice((1.25e6, 1.25e7, 1.25e8, 1.25e9)) * rng.uniform(0.01, 0.3) if up else 0
+            table[IF_TABLE + (1, if_index)] = ("Integer", lambda now, i=if_index: i)
+            table[IF_TABLE + (2, if_index)] = ("OctetString", lambda now, i=if_index: f"eth{i - 1}")
+            table[IF_TABLE + (8, if_index)] = ("Integer", lambda now, status=1 if up else 2: status)
+            table[IF_TABLE + (10, if_index)] = self._counter(mean)
+            table[IF_TABLE + (16, if_index)] = self._counter(mean * rng.uniform(0.2, 1.2))
+            table[IF_TABLE + (14, if_index)] = self._counter(mean * 1e-7)
+            table[IF_TABLE + (20, if_index)] = self._counter(mean * 1e-7)
+
+        self.keys = sorted(table)
+        self.table = table
+
+    def _counter(self, mean):
+        return "Counter32", lambda now: int(octets(mean, self.booted, now)) % 2 ** 32
+
+    def value(self, key, now):
+        """(value type, plain value) of `key` at `now`, or None if the device has no such OID."""
+        entry = self.table.get(key)
+        return None if entry is None else (entry[0], entry[1](now))
+
+    def get(self, key, now):
+        entry = self.table.get(key)
+        if entry is None:
+            return v2c.NoSuchInstance("")
+        return getattr(v2c, entry[0])(entry[1](now))
+
+    def next(self, key, now):
+        """(next oid, value) after `key`, or None at the end of the MIB."""
+        i = bisect.bisect_right(self.keys, key)
+        if i == len(self.keys):
+            return None
+        return self.keys[i], self.get(self.keys[i], now)
+
+    def respond(self, data, community):
+        """Answers one request datagram; returns the response bytes or None to drop it."""
+        if int(api.decodeMessageVersion(data)) != api.protoVersion2c:
+            return None
+        request, _ = decoder.decode(data, asn1Spec=v2c.Message())
+        if str(v2c.apiMessage.getCommunity(request)) != community:
+            return None
+        request_pdu = v2c.apiMessage.getPDU(request)
+        response = v2c.apiMessage.getResponse(request)
+        response_pdu = v2c.apiMessage.getPDU(response)
+        keys = [tuple(name) for name, _ in v2c.apiPDU.getVarBinds(request_pdu)]
+        now = time.time()
+
+        if request_pdu.isSameTypeWith(v2c.GetRequestPDU()):
+            var_binds = [(key, self.get(key, now)) for key in keys]
+        elif request_pdu.isSameTypeWith(v2c.GetNextRequestPDU()):
+            var_binds = [self._next_or_end(key, now) for key in keys]
+        elif request_pdu.isSameTypeWith(v2c.GetBulkRequestPDU()):
+            non_repeaters = int(v2c.apiBulkPDU.getNonRepeaters(request_pdu))
+            max_repetitions = int(v2c.apiBulkPDU.getMaxRepetitions(request_pdu))
+            var_binds = [self._next_or_end(key, now) for key in keys[:non_repeaters]]
+            repeaters = keys[non_repeaters:]
+            for _ in range(max_repetitions):
+                row = [self._next_or_end(key, now) for key in repeaters]
+                var_binds.extend(row)
+                repeaters = [key for key, _ in row]
+        else:
+            return None
+
+        v2c.apiPDU.setVarBinds(response_pdu, var_binds)
+        return encoder.encode(response)
+
+    def _next_or_end(self, key, now):
+        found = self.next(key, now)
+        return (key, v2c.EndOfMibView("")) if found is None else found
+
+
+# Function to answer SNMP requests for some devices until interrupted
+def serve(indexes, interfaces, host=DEFAULT_HOST, base_port=DEFAULT_BASE_PORT, community=DEFAULT_COMMUNITY,
+          booted=None):
+    selector = selectors.DefaultSelector()
+    for index in indexes:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.bind((host, base_port + index))
+        selector.register(sock, selectors.EVENT_READ, SyntheticDevice(index, interfaces, booted))
+    try:
+        while True:
+            for key, _ in selector.select():
+                data, address = key.fileobj.recvfrom(65535)
+                try:
+                    response = key.data.respond(data, community)
+                except Exception as e:
+                    print(f"Error answering {address}: {e}")
+                    continue
+                if response is not None:
+                    key.fileobj.sendto(response, address)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+
+
+# Function to run the agent for `devices` devices in `processes` processes
+def start(devices, interfaces, processes=1, host=DEFAULT_HOST, base_port=DEFAULT_BASE_PORT,
+          community=DEFAULT_COMMUNITY, booted=None):
+    """Returns the started processes; terminate() them when done."""
+    booted = time.time() if booted is None else booted
+    workers = []
+    for p in range(max(1, min(processes, devices))):
+        worker = multiprocessing.Process(
+            target=serve,
+            args=(range(p, devices, processes), interfaces, host, base_port, community, booted),
+            name=f"agent-{p}",
+            daemon=True,
+        )
+        worker.start()
+        workers.append(worker)
+    return workers
+
+
+# Function to list the simulated devices in the collector's inventory format
+def inventory(devices, host=DEFAULT_HOST, base_port=DEFAULT_BASE_PORT, community=DEFAULT_COMMUNITY, interval=60):
+    return [
+        {"ip": host, "port": base_port + i, "community": community, "interval": interval}
+        for i in range(devices)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run synthetic SNMPv2c agents, one UDP port per device.")
+    parser.add_argument("--devices", type=int, default=DEFAULT_DEVICES)
+    parser.add_argument("--interfaces", type=int, default=DEFAULT_INTERFACES, help="interfaces per device")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--base-port", type=int, default=DEFAULT_BASE_PORT, help="device i listens on base-port + i")
+    parser.add_argument("--community", default=DEFAULT_COMMUNITY)
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+    print(f"Serving {args.devices} device(s) x {args.interfaces} interface(s) on "
+          f"{args.host}:{args.base_port}-{args.base_port + args.devices - 1}")
+    workers = start(args.devices, args.interfaces, args.processes, args.host, args.base_port, args.community)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("Exiting program...")
@@ -0,0 +1,264 @@
+import json
+import math
+import os
+import queue
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+# Alert rules; alerting is off when the file does not exist
+ALERTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alerts.json")
+# Rolling state of every series, so a restart does not start from scratch
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alert_state.json")
+# Firing and resolved alerts, one JSON object per line
+ALERT_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alerts.log")
+
+# Seconds between state checkpoints
+CHECKPOINT_INTERVAL = 60
+# A previous sample older than this is not used for a rate
+MAX_GAP = 900
+# Seconds to wait for the webhook
+WEBHOOK_TIMEOUT = 5
+
+UPTIME_METRIC = "System Uptime"
+COUNTER_MODULUS = {"Counter32": 2 ** 32, "Counter64": 2 ** 64}
+
+# Defaults of the optional rule fields
+DEFAULT_ALPHA = 0.1
+DEFAULT_WARMUP = 10
+
+
+class Rule:
+    """
+    One entry of alerts.json:
+
+        {"name": "...", "metric": "Input Errors",
+         "above": 1.0, "below": null,          # thresholds on the value
+         "capacity_bps": 1e9,                  # value becomes utilisation (0-1) of this link speed
+         "sigma": 4, "alpha": 0.1, "warmup": 10,   # anomaly: this far from the EWMA baseline
+         "for": 1,                             # consecutive breaches before firing
+         "devices": ["10.0.0.1:161"]}          # only these devices (default all)
+
+    Counters are evaluated as per-second rates, everything else as read.
+    """
+
+    def __init__(self, entry):
+        self.name = entry["name"]
+        self.metric = entry["metric"]
+        self.above = entry.get("above")
+        self.below = entry.get("below")
+        self.capacity_bps = entry.get("capacity_bps")
+        self.sigma = entry.get("sigma")
+        self.alpha = float(entry.get("alpha", DEFAULT_ALPHA))
+        self.warmup = int(entry.get("warmup", DEFAULT_WARMUP))
+        self.consecutive = int(entry.get("for", 1))
+        self.devices = set(entry["devices"]) if entry.get("devices") else None
+        if self.above is None and self.below is None and self.sigma is None:
+            raise ValueError(f"Alert rule {self.name!r} needs above, below or sigma")
+
+    def transform(self, x):
+        # Octets per second to the fraction of the link in use
+        return x * 8 / self.capacity_bps if self.capacity_bps else x
+
+    def breached(self, x, state):
+        """Checks x against the rule, then folds it into the EWMA baseline."""
+        breach = ((self.above is not None and x > self.above)
+                  or (self.below is not None and x < self.below))
+        if self.sigma is not None:
+            mean, var, n = state.get("mean"), state.get("var", 0.0), state.get("n", 0)
+            if mean is None:
+                state["mean"], state["var"], state["n"] = x, 0.0, 1
+                return breach
+            deviation = abs(x - mean)
+            if n >= self.warmup and deviation > self.sigma * math.sqrt(var) and deviation > 0:
+                breach = True
+            # Exponentially weighted mean and variance, O(1) per sample
+            diff = x - mean
+            state["mean"] = mean + self.alpha * diff
+            state["var"] = (1 - self.alpha) * (var + self.alpha * diff * diff)
+            state["n"] = n + 1
+        return breach
+
+
+def load_rules(path=ALERTS_FILE):
+    """Returns (rules, webhook URL or None); no rules if the file does not exist."""
+    if not os.path.exists(path):
+        return [], None
+    with open(path) as f:
+        config = json.load(f)
+    return [Rule(entry) for entry in config.get("rules", [])], config.get("webhook")
+
+
+class AlertEvaluator:
+    """
+    Evaluates alert rules on samples as the poller produces them, before
+    they are written, so alerting adds no database queries and fires on
+    the poll that crosses the line.
+
+    State is O(1) per series: the previous counter reading for rates, and
+    per rule the EWMA mean/variance, the breach streak and whether it is
+    firing. It is checkpointed to `state_path` and reloaded on start.
+    """
+
+    def __init__(self, rules, webhook=None, state_path=STATE_FILE, log_path=ALERT_LOG, stats=None):
+        self.rules = {}
+        for rule in rules:
+            self.rules.setdefault(rule.metric, []).append(rule)
+        self.webhook = webhook
+        self.state_path = state_path
+        self.log_path = log_path
+        self.stats = stats
+        self.lock = threading.Lock()
+        # (ip_port, oid) -> {"v": last value, "t": its timestamp}
+        self.counters = {}
+        # "rule|ip_port|oid" -> rule state
+        self.states = {}
+        # ip_port -> last sysUpTime, to spot restarts
+        self.uptimes = {}
+        self.last_checkpoint = time.monotonic()
+        self._load()
+        self.outbox = None
+        if webhook:
+            self.outbox = queue.Queue()
+            threading.Thread(target=self._send, name="alert-webhook", daemon=True).start()
+
+    def observe(self, samples):
+        """Evaluates one poll's samples; called from the poller threads."""
+        if not self.rules:
+            return
+        events = []
+        with self.lock:
+            for s in samples:
+                if s.metric_name == UPTIME_METRIC:
+                    self._check_restart(s)
+            for s in samples:
+                rules = self.rules.get(s.metric_name)
+                if rules:
+                    self._evaluate(s, rules, events)
+        for event in events:
+            self._emit(event)
+
+    def _check_restart(self, s):
+        try:
+            uptime = float(s.value)
+        except (TypeError, ValueError):
+            return
+        previous = self.uptimes.get(s.ip_port)
+        self.uptimes[s.ip_port] = uptime
+        if previous is not None and uptime < previous:
+            # Counters restarted from zero; their next reading starts a new rate
+            for key in [key for key in self.counters if key[0] == s.ip_port]:
+                del self.counters[key]
+
+    def _evaluate(self, s, rules, events):
+        try:
+            value = float(s.value)
+        except (TypeError, ValueError):
+            return
+        timestamp = s.timestamp or time.time()
+
+        modulus = COUNTER_MODULUS.get(s.value_type)
+        if modulus is not None:
+            previous = self.counters.get((s.ip_port, s.oid))
+            self.counters[(s.ip_port, s.oid)] = {"v": value, "t": timestamp}
+            if previous is None or not 0 < timestamp - previous["t"] <= MAX_GAP:
+                return
+            delta = value - previous["v"] if value >= previous["v"] else value + modulus - previous["v"]
+            x = delta / (timestamp - previous["t"])
+        else:
+            x = value
+
+        for rule in rules:
+            if rule.devices is not None and s.ip_port not in rule.devices:
+                continue
+            key = f"{rule.name}|{s.ip_port}|{s.oid}"
+            state = self.states.setdefault(key, {})
+            y = rule.transform(x)
+            if rule.breached(y, state):
+                state["streak"] = state.get("streak", 0) + 1
+                if state["streak"] >= rule.consecutive and not state.get("firing"):
+                    state["firing"] = True
+                    events.append(self._event("firing", rule, s, y, timestamp))
+            else:
+                state["streak"] = 0
+                if state.get("firing"):
+                    state["firing"] = False
+                    events.append(self._event("resolved", rule, s, y, timestamp))
+
+    @staticmethod
+    def _event(status, rule, s, value, timestamp):
+        return {
+            "status": status,
+            "rule": rule.name,
+            "metric": s.metric_name,
+            "device": s.ip_port,
+            "if_index": s.if_index,
+            "value": value,
+            "above": rule.above,
+            "below": rule.below,
+            "sigma": rule.sigma,
+            "time": datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds"),
+        }
+
+    def _emit(self, event):
+        where = event["device"] + (f"/{event['if_index']}" if event["if_index"] is not None else "")
+        print(f"ALERT {event['status']}: {event['rule']} on {where} (value {event['value']:.4g})")
+        if self.stats is not None and event["status"] == "firing":
+            self.stats.add(alerts=1)
+        try:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(event) + "\n")
+        except OSError as e:
+            print(f"Error writing alert log: {e}")
+        if self.outbox is not None:
+            self.outbox.put(event)
+
+    def _send(self):
+        while True:
+            event = self.outbox.get()
+            request = urllib.request.Request(self.webhook, data=json.dumps(event).encode(),
+                                             headers={"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT).close()
+            except Exception as e:
+                print(f"Error sending alert to {self.webhook}: {e}")
+
+    def maybe_checkpoint(self):
+        if time.monotonic() - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Writes the state atomically, so a crash mid-write keeps the last one."""
+        self.last_checkpoint = time.monotonic()
+        if not self.rules:
+            return
+        with self.lock:
+            state = {
+                "counters": [[ip_port, oid, v] for (ip_port, oid), v in self.counters.items()],
+                "states": self.states,
+                "uptimes": self.uptimes,
+            }
+            data = json.dumps(state)
+        try:
+            with open(self.state_path + ".tmp", "w") as f:
+                f.write(data)
+            os.replace(self.state_path + ".tmp", self.state_path)
+        except OSError as e:
+            print(f"Error saving alert state: {e}")
+
+    def _load(self):
+        if not self.rules or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading alert state: {e}")
+            return
+        self.counters = {(ip_port, oid): v for ip_port, oid, v in state.get("counters", [])}
+        self.uptimes = state.get("uptimes", {})
+        # State of rules that were removed from alerts.json is dropped
+        names = {rule.name for rules in self.rules.values() for rule in rules}
+        self.states = {key: s for key, s in state.get("states", {}).items() if key.split("|", 1)[0] in names}
+        print(f"Loaded alert state for {len(self.states)} series")
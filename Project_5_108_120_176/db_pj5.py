@@ -1,107 +1,317 @@
-import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-
-# Define connection parameters for the default PostgreSQL database
-POSTGRES_USER = "postgres"
-POSTGRES_PASSWORD = "<PASSWORD>"  # Replace with your postgres user's password
-POSTGRES_HOST = "localhost"
-POSTGRES_PORT = "5432"
-
-# Define parameters for the new database and user
-NEW_DB_NAME = "mib"
-NEW_USER_NAME = "user_management"
-NEW_USER_PASSWORD = "management"
-
-# Define the table schema
-TABLE_SCHEMA = """
-CREATE TABLE IF NOT EXISTS snmp_critical_metrics (
-    id SERIAL PRIMARY KEY,
-    metric_name VARCHAR(255) NOT NULL,
-    oid VARCHAR(255) NOT NULL,
-    value TEXT,
-    value_type VARCHAR(50),
-    ip_port VARCHAR(50),
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-"""
-
-try:
-    # Step 1: Connect to the default PostgreSQL database
-    connection = psycopg2.connect(
-        dbname="postgres",
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT
-    )
-    connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)  # Allow database creation
-    cursor = connection.cursor()
-
-    # Step 2: Check if the database exists
-    cursor.execute(f"SELECT 1 FROM pg_database WHERE datname = '{NEW_DB_NAME}';")
-    db_exists = cursor.fetchone()
-    if not db_exists:
-        # Create the new database if it doesn't exist
-        cursor.execute(f"CREATE DATABASE {NEW_DB_NAME};")
-        print(f"Database '{NEW_DB_NAME}' created successfully.")
-    else:
-        print(f"Database '{NEW_DB_NAME}' already exists.")
-
-    # Step 3: Check if the user exists
-    cursor.execute(f"SELECT 1 FROM pg_roles WHERE rolname = '{NEW_USER_NAME}';")
-    user_exists = cursor.fetchone()
-    if not user_exists:
-        # Create the new user if it doesn't exist
-        cursor.execute(f"CREATE USER {NEW_USER_NAME} WITH PASSWORD '{NEW_USER_PASSWORD}';")
-        print(f"User '{NEW_USER_NAME}' created successfully.")
-    else:
-        print(f"User '{NEW_USER_NAME}' already exists.")
-
-    # Step 4: Grant permissions to the new user on the database
-    cursor.execute(f"GRANT ALL PRIVILEGES ON DATABASE {NEW_DB_NAME} TO {NEW_USER_NAME};")
-    print(f"Granted all privileges on '{NEW_DB_NAME}' to '{NEW_USER_NAME}'.")
-
-    # modify steps 4 to fix the error of permission denied for schema public
-    #####################################################################################
-    # Grant privileges on the public schema to the new user
-    connection = psycopg2.connect(
-        dbname=NEW_DB_NAME,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT
-    )
-    connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-    cursor = connection.cursor()
-
-    cursor.execute(f"GRANT USAGE ON SCHEMA public TO {NEW_USER_NAME};")
-    cursor.execute(f"GRANT CREATE ON SCHEMA public TO {NEW_USER_NAME};")
-    cursor.execute(f"ALTER SCHEMA public OWNER TO {NEW_USER_NAME};")
-    print(f"Granted privileges and ownership of schema 'public' to '{NEW_USER_NAME}'.")
-    #####################################################################################
-
-    # Close the cursor and connection to the default database
-    cursor.close()
-    connection.close()
-
-    # Step 5: Connect to the newly created database as the new user
-    connection = psycopg2.connect(
-        dbname=NEW_DB_NAME,
-        user=NEW_USER_NAME,
-        password=NEW_USER_PASSWORD,
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT
-    )
-    connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-    cursor = connection.cursor()
-
-    # Step 6: Create the new table
-    cursor.execute(TABLE_SCHEMA)
-    print(f"Table 'snmp_critical_metrics' created successfully in database '{NEW_DB_NAME}'.")
-
-    # Close the cursor and connection
-    cursor.close()
-    connection.close()
-
-except Exception as e:
-    print(f"An error occurred: {e}")
+import argparse
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# Define connection parameters for the default PostgreSQL database
+POSTGRES_USER = "postgres"
+POSTGRES_PASSWORD = "<PASSWORD>"  # Replace with your postgres user's password
+POSTGRES_HOST = "localhost"
+POSTGRES_PORT = "5432"
+
+# Define parameters for the new database and user
+NEW_DB_NAME = "mib"
+NEW_USER_NAME = "user_management"
+NEW_USER_PASSWORD = "management"
+
+# Partition maintenance settings
+PARTITION_PREFIX = "snmp_samples_p"   # one partition per day: snmp_samples_pYYYYMMDD
+PRECREATE_DAYS = 7                    # partitions created ahead of today
+RETENTION_DAYS = 90                   # partitions older than this are dropped or detached
+# Days each rollup resolution is kept; the API reads raw samples (or the
+# cold archive) for older buckets while they still exist
+ROLLUP_RETENTION_DAYS = {"1m": 30, "5m": 180, "1h": 730}
+
+# Define the table schema
+# Devices and metrics are small dimension tables; every sample row only
+# carries their integer keys, a numeric value and the collection time.
+# Samples are range-partitioned by day on timestamp, so old data can be
+# removed with DROP TABLE and time-bounded queries only touch the days
+# they need.
+TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snmp_devices (
+    device_id SMALLSERIAL PRIMARY KEY,
+    ip_port VARCHAR(50) NOT NULL UNIQUE,
+    last_sample TIMESTAMP
+);
+-- Time of the newest sample of each device, kept up to date by the writer
+-- so the API never has to scan snmp_samples for it
+ALTER TABLE snmp_devices ADD COLUMN IF NOT EXISTS last_sample TIMESTAMP;
+
+CREATE TABLE IF NOT EXISTS snmp_metrics (
+    metric_id SERIAL PRIMARY KEY,
+    metric_name VARCHAR(255) NOT NULL,
+    oid VARCHAR(255) NOT NULL UNIQUE,
+    if_index INTEGER,
+    value_type VARCHAR(50)
+);
+CREATE INDEX IF NOT EXISTS snmp_metrics_name_idx ON snmp_metrics (metric_name);
+
+CREATE TABLE IF NOT EXISTS snmp_samples (
+    metric_id INTEGER NOT NULL REFERENCES snmp_metrics (metric_id),
+    device_id SMALLINT NOT NULL REFERENCES snmp_devices (device_id),
+    timestamp TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
+    value DOUBLE PRECISION NOT NULL
+) PARTITION BY RANGE (timestamp);
+CREATE INDEX IF NOT EXISTS snmp_samples_metric_device_ts_idx
+    ON snmp_samples (metric_id, device_id, timestamp);
+"""
+
+# Rate rollups of counter metrics, one table per resolution. Each bucket
+# keeps sum/count so partial buckets can be merged as new samples arrive.
+ROLLUP_RESOLUTIONS = ("1m", "5m", "1h")
+
+ROLLUP_SCHEMA = "".join(f"""
+CREATE TABLE IF NOT EXISTS snmp_rollup_{resolution} (
+    metric_id INTEGER NOT NULL,
+    device_id SMALLINT NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    rate_sum DOUBLE PRECISION NOT NULL,
+    rate_count INTEGER NOT NULL,
+    rate_min DOUBLE PRECISION NOT NULL,
+    rate_max DOUBLE PRECISION NOT NULL,
+    rate_last DOUBLE PRECISION NOT NULL,
+    last_ts TIMESTAMP NOT NULL,
+    PRIMARY KEY (metric_id, device_id, bucket)
+);
+CREATE INDEX IF NOT EXISTS snmp_rollup_{resolution}_bucket_idx ON snmp_rollup_{resolution} (bucket);
+""" for resolution in ROLLUP_RESOLUTIONS) + """
+CREATE TABLE IF NOT EXISTS snmp_rollup_state (
+    metric_id INTEGER NOT NULL,
+    device_id SMALLINT NOT NULL,
+    last_ts TIMESTAMP NOT NULL,
+    last_value DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (metric_id, device_id)
+);
+
+CREATE TABLE IF NOT EXISTS snmp_rollup_watermark (
+    name VARCHAR(50) PRIMARY KEY,
+    watermark TIMESTAMP NOT NULL
+);
+"""
+
+# One row per collector process when the collector runs sharded (shard_pj5.py)
+COLLECTOR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snmp_collector_leases (
+    worker_id VARCHAR(100) PRIMARY KEY,
+    heartbeat TIMESTAMP NOT NULL,
+    started TIMESTAMP NOT NULL,
+    devices INTEGER NOT NULL DEFAULT 0,
+    collected BIGINT NOT NULL DEFAULT 0,
+    inserted BIGINT NOT NULL DEFAULT 0,
+    samples_per_second DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+"""
+
+# Original single-table layout, kept so migrate_pj5.py can read old data
+LEGACY_TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snmp_critical_metrics (
+    id SERIAL PRIMARY KEY,
+    metric_name VARCHAR(255) NOT NULL,
+    oid VARCHAR(255) NOT NULL,
+    value TEXT,
+    value_type VARCHAR(50),
+    ip_port VARCHAR(50),
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+# Function to connect to the metrics database as the application user
+def connect_as_user():
+    return psycopg2.connect(
+        dbname=NEW_DB_NAME,
+        user=NEW_USER_NAME,
+        password=NEW_USER_PASSWORD,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT
+    )
+
+
+def partition_name(day):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+# Function to create the daily partitions for [first_day, last_day]
+def create_partitions(cursor, first_day, last_day):
+    day = first_day
+    while day <= last_day:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF snmp_samples "
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}');"
+        )
+        day += timedelta(days=1)
+
+
+# Function to list the attached daily partitions as [(name, day)]
+def list_partitions(cursor):
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'snmp_samples'::regclass
+        ORDER BY c.relname;
+    """)
+    partitions = []
+    for (name,) in cursor.fetchall():
+        suffix = name[len(PARTITION_PREFIX):]
+        if name.startswith(PARTITION_PREFIX) and suffix.isdigit():
+            partitions.append((name, datetime.strptime(suffix, "%Y%m%d").date()))
+    return partitions
+
+
+# Function to make sure partitions exist from today through `precreate_days` ahead
+def ensure_partitions(connection, precreate_days=PRECREATE_DAYS):
+    cursor = connection.cursor()
+    # Sample times are UTC, so days (and partitions) are UTC days
+    cursor.execute("SELECT (now() AT TIME ZONE 'UTC')::date;")
+    today = cursor.fetchone()[0]
+    create_partitions(cursor, today, today + timedelta(days=precreate_days))
+    connection.commit()
+    cursor.close()
+    return today
+
+
+# Function to pre-create future partitions and expire old ones
+def maintain_partitions(connection, retention_days=RETENTION_DAYS, precreate_days=PRECREATE_DAYS,
+                        detach=False):
+    """
+    Makes sure partitions exist from today through `precreate_days` ahead,
+    then drops (or, with `detach`, detaches and keeps as plain tables)
+    every partition whose whole day is older than `retention_days`.
+    """
+    today = ensure_partitions(connection, precreate_days)
+    cursor = connection.cursor()
+
+    cutoff = today - timedelta(days=retention_days)
+    expired = [(name, day) for name, day in list_partitions(cursor) if day < cutoff]
+    for name, day in expired:
+        if detach:
+            cursor.execute(f"ALTER TABLE snmp_samples DETACH PARTITION {name};")
+            print(f"Detached partition '{name}' ({day}).")
+        else:
+            cursor.execute(f"DROP TABLE {name};")
+            print(f"Dropped partition '{name}' ({day}).")
+
+    connection.commit()
+    cursor.close()
+    return expired
+
+
+# Function to delete rollup buckets older than their resolution's retention
+def expire_rollups(connection, retention_days=ROLLUP_RETENTION_DAYS):
+    cursor = connection.cursor()
+    cursor.execute("SELECT (now() AT TIME ZONE 'UTC')::date;")
+    today = cursor.fetchone()[0]
+    for resolution in ROLLUP_RESOLUTIONS:
+        cutoff = today - timedelta(days=retention_days[resolution])
+        cursor.execute(f"DELETE FROM snmp_rollup_{resolution} WHERE bucket < %s;", (cutoff,))
+        if cursor.rowcount:
+            print(f"Deleted {cursor.rowcount} '{resolution}' rollup bucket(s) before {cutoff}.")
+    connection.commit()
+    cursor.close()
+
+
+def setup_database():
+    try:
+        # Step 1: Connect to the default PostgreSQL database
+        connection = psycopg2.connect(
+            dbname="postgres",
+            user=POSTGRES_USER,
+            password=POSTGRES_PASSWORD,
+            host=POSTGRES_HOST,
+            port=POSTGRES_PORT
+        )
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)  # Allow database creation
+        cursor = connection.cursor()
+
+        # Step 2: Check if the database exists
+        cursor.execute(f"SELECT 1 FROM pg_database WHERE datname = '{NEW_DB_NAME}';")
+        db_exists = cursor.fetchone()
+        if not db_exists:
+            # Create the new database if it doesn't exist
+            cursor.execute(f"CREATE DATABASE {NEW_DB_NAME};")
+            print(f"Database '{NEW_DB_NAME}' created successfully.")
+        else:
+            print(f"Database '{NEW_DB_NAME}' already exists.")
+
+        # Step 3: Check if the user exists
+        cursor.execute(f"SELECT 1 FROM pg_roles WHERE rolname = '{NEW_USER_NAME}';")
+        user_exists = cursor.fetchone()
+        if not user_exists:
+            # Create the new user if it doesn't exist
+            cursor.execute(f"CREATE USER {NEW_USER_NAME} WITH PASSWORD '{NEW_USER_PASSWORD}';")
+            print(f"User '{NEW_USER_NAME}' created successfully.")
+        else:
+            print(f"User '{NEW_USER_NAME}' already exists.")
+
+        # Step 4: Grant permissions to the new user on the database
+        cursor.execute(f"GRANT ALL PRIVILEGES ON DATABASE {NEW_DB_NAME} TO {NEW_USER_NAME};")
+        print(f"Granted all privileges on '{NEW_DB_NAME}' to '{NEW_USER_NAME}'.")
+
+        # modify steps 4 to fix the error of permission denied for schema public
+        #####################################################################################
+        # Grant privileges on the public schema to the new user
+        connection = psycopg2.connect(
+            dbname=NEW_DB_NAME,
+            user=POSTGRES_USER,
+            password=POSTGRES_PASSWORD,
+            host=POSTGRES_HOST,
+            port=POSTGRES_PORT
+        )
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = connection.cursor()
+
+        cursor.execute(f"GRANT USAGE ON SCHEMA public TO {NEW_USER_NAME};")
+        cursor.execute(f"GRANT CREATE ON SCHEMA public TO {NEW_USER_NAME};")
+        cursor.execute(f"ALTER SCHEMA public OWNER TO {NEW_USER_NAME};")
+        print(f"Granted privileges and ownership of schema 'public' to '{NEW_USER_NAME}'.")
+        #####################################################################################
+
+        # Close the cursor and connection to the default database
+        cursor.close()
+        connection.close()
+
+        # Step 5: Connect to the newly created database as the new user
+        connection = connect_as_user()
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = connection.cursor()
+
+        # Step 6: Create the tables
+        cursor.execute(TABLE_SCHEMA)
+        print(f"Tables 'snmp_devices', 'snmp_metrics' and 'snmp_samples' created successfully in database '{NEW_DB_NAME}'.")
+        cursor.execute(ROLLUP_SCHEMA)
+        print(f"Rollup tables created successfully in database '{NEW_DB_NAME}'.")
+        cursor.execute(COLLECTOR_SCHEMA)
+
+        # Step 7: Create the first daily partitions
+        maintain_partitions(connection)
+        print(f"Created partitions for today and the next {PRECREATE_DAYS} day(s).")
+
+        # Close the cursor and connection
+        cursor.close()
+        connection.close()
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Set up or maintain the SNMP metrics database.")
+    parser.add_argument("command", nargs="?", choices=["setup", "maintain"], default="setup",
+                        help="'setup' creates the database, user and tables (default); "
+                             "'maintain' pre-creates partitions and expires old partitions and rollups")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+    parser.add_argument("--precreate-days", type=int, default=PRECREATE_DAYS)
+    parser.add_argument("--detach", action="store_true",
+                        help="detach expired partitions instead of dropping them")
+    args = parser.parse_args()
+
+    if args.command == "setup":
+        setup_database()
+    else:
+        connection = connect_as_user()
+        maintain_partitions(connection, args.retention_days, args.precreate_days, args.detach)
+        expire_rollups(connection)
+        connection.close()
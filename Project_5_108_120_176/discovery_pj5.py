@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import namedtuple
+
+from pysnmp.hlapi import ObjectIdentity, ObjectType, bulkCmd, getCmd
+
+# IF-MIB objects used for interface discovery
+IF_NUMBER = "1.3.6.1.2.1.2.1.0"
+IF_TABLE_LAST_CHANGE = "1.3.6.1.2.1.31.1.5.0"
+IF_INDEX = "1.3.6.1.2.1.2.2.1.1"
+IF_DESCR = "1.3.6.1.2.1.2.2.1.2"
+IF_OPER_STATUS = "1.3.6.1.2.1.2.2.1.8"
+
+# ifOperStatus value for an interface that is up
+OPER_STATUS_UP = "1"
+
+# How long a discovered interface map is trusted before it is walked again
+DISCOVERY_TTL = 600  # seconds
+
+# Largest max-repetitions used for GETBULK walks of the ifTable
+MAX_REPETITIONS = 25
+
+InterfaceMap = namedtuple(
+    "InterfaceMap",
+    ["up", "down", "descr", "if_number", "last_change", "discovered_at"],
+)
+
+
+# Function to walk whole ifTable columns with GETBULK
+def walk_columns(session, column_oids, max_repetitions=MAX_REPETITIONS):
+    """
+    Walks each column in `column_oids` and returns
+    {column_oid: {index: value}}. Returns None if the agent did not answer.
+    """
+    columns = {column: {} for column in column_oids}
+    try:
+        for errorIndication, errorStatus, errorIndex, varBinds in bulkCmd(
+            session.engine,
+            session.auth,
+            session.transport,
+            session.context,
+            0, max_repetitions,
+            *[ObjectType(ObjectIdentity(column)) for column in column_oids],
+            lexicographicMode=False,
+            lookupMib=False
+        ):
+            if errorIndication:
+                print(f"SNMP Error ({session.ip_port}): {errorIndication}")
+                return None
+            elif errorStatus:
+                print(f"SNMP Error ({session.ip_port}): {errorStatus.prettyPrint()}")
+                return None
+            for oid, value in varBinds:
+                oid = str(oid)
+                for column in column_oids:
+                    if oid.startswith(column + "."):
+                        columns[column][int(oid[len(column) + 1:])] = str(value)
+                        break
+    except Exception as e:
+        print(f"Error walking ifTable on {session.ip_port}: {e}")
+        return None
+    return columns
+
+
+# Function to read the interface table of one device
+def discover_interfaces(session):
+    """
+    Reads ifNumber and ifTableLastChange, then walks ifIndex, ifDescr and
+    ifOperStatus once. Returns an InterfaceMap or None on failure.
+    """
+    try:
+        errorIndication, errorStatus, errorIndex, varBinds = next(getCmd(
+            session.engine,
+            session.auth,
+            session.transport,
+            session.context,
+            ObjectType(ObjectIdentity(IF_NUMBER)),
+            ObjectType(ObjectIdentity(IF_TABLE_LAST_CHANGE)),
+            lookupMib=False
+        ))
+    except Exception as e:
+        print(f"Error discovering interfaces on {session.ip_port}: {e}")
+        return None
+    if errorIndication or errorStatus:
+        print(f"SNMP Error ({session.ip_port}): {errorIndication or errorStatus.prettyPrint()}")
+        return None
+
+    scalars = {str(oid): value for oid, value in varBinds}
+    try:
+        if_number = int(scalars[IF_NUMBER])
+    except Exception:
+        if_number = 0
+    try:
+        last_change = str(int(scalars[IF_TABLE_LAST_CHANGE]))
+    except Exception:
+        # Agent does not implement IF-MIB::ifTableLastChange
+        last_change = None
+
+    columns = walk_columns(
+        session,
+        [IF_INDEX, IF_DESCR, IF_OPER_STATUS],
+        max_repetitions=max(1, min(if_number, MAX_REPETITIONS)),
+    )
+    if columns is None:
+        return None
+
+    up = []
+    down = []
+    for index in sorted(columns[IF_INDEX]):
+        if columns[IF_OPER_STATUS].get(index) == OPER_STATUS_UP:
+            up.append(index)
+        else:
+            down.append(index)
+
+    print(f"Discovered {len(up)} up / {len(down)} down interface(s) on {session.ip_port}")
+    return InterfaceMap(
+        up=up,
+        down=down,
+        descr=columns[IF_DESCR],
+        if_number=if_number,
+        last_change=last_change,
+        discovered_at=time.monotonic(),
+    )
+
+
+class InterfaceCache:
+    """
+    Keeps the discovered InterfaceMap of each device. A map is walked again
+    once it is older than `ttl`, or as soon as a poll shows that ifNumber or
+    ifTableLastChange moved or that a down interface came up.
+    """
+
+    def __init__(self, ttl=DISCOVERY_TTL):
+        self.ttl = ttl
+        self.maps = {}
+        self.lock = threading.Lock()
+
+    def get(self, session):
+        with self.lock:
+            interfaces = self.maps.get(session.ip_port)
+        if interfaces is None or time.monotonic() - interfaces.discovered_at > self.ttl:
+            interfaces = discover_interfaces(session)
+            # A failed discovery is not cached so the next poll retries it
+            with self.lock:
+                if interfaces is None:
+                    self.maps.pop(session.ip_port, None)
+                else:
+                    self.maps[session.ip_port] = interfaces
+        return interfaces
+
+    def invalidate(self, ip_port):
+        with self.lock:
+            self.maps.pop(ip_port, None)
+
+    @staticmethod
+    def check_oids(interfaces):
+        """OIDs to add to every poll so a stale map is noticed."""
+        return [IF_NUMBER, IF_TABLE_LAST_CHANGE] + [f"{IF_OPER_STATUS}.{i}" for i in interfaces.down]
+
+    def check(self, ip_port, interfaces, results):
+        """
+        Compares the change-detection OIDs of a poll with the cached map and
+        drops the map when the interface table changed.
+        """
+        changed = False
+        if IF_NUMBER in results and int(results[IF_NUMBER][0]) != interfaces.if_number:
+            changed = True
+        if (interfaces.last_change is not None and IF_TABLE_LAST_CHANGE in results
+                and results[IF_TABLE_LAST_CHANGE][0] != interfaces.last_change):
+            changed = True
+        for index in interfaces.down:
+            status = results.get(f"{IF_OPER_STATUS}.{index}")
+            if status and status[0] == OPER_STATUS_UP:
+                changed = True
+                break
+
+        if changed:
+            print(f"Interface table changed on {ip_port}; rediscovering on next poll")
+            self.invalidate(ip_port)
+        return changed
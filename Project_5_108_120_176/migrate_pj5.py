@@ -0,0 +1,219 @@
+import argparse
+
+from psycopg2.extras import execute_values
+
+from db_pj5 import TABLE_SCHEMA, connect_as_user, create_partitions, ensure_partitions
+from snmp_pj5 import INTERFACE_METRICS, SCALAR_METRICS
+
+# Rows copied per transaction
+BATCH_ROWS = 200000
+
+# How far each old table has been copied, updated in the same transaction
+# as the rows, so a rerun (or a run after a failure) continues where the
+# last one stopped instead of copying rows twice
+PROGRESS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snmp_migration_progress (
+    source VARCHAR(100) PRIMARY KEY,
+    next_id BIGINT NOT NULL
+);
+"""
+
+PROGRESS_QUERY = """
+    INSERT INTO snmp_migration_progress (source, next_id) VALUES (%s, %s)
+    ON CONFLICT (source) DO UPDATE SET next_id = EXCLUDED.next_id;
+"""
+
+# The old tables hold local times, either from CURRENT_TIMESTAMP or from the
+# collector's clock; snmp_samples holds naive UTC. %s is the old time zone
+TO_UTC = "(({column} AT TIME ZONE %s) AT TIME ZONE 'UTC')"
+
+
+# Function to turn an old (metric_name, oid) pair into the new metric row
+def normalize_metric(metric_name, oid):
+    """
+    Old rows stored OIDs the way pysnmp printed them, e.g.
+    'IF-MIB::ifInOctets.3' or 'SNMPv2-MIB::sysUpTime.0'. Returns
+    (numeric_oid, if_index) for the metric definitions the collector uses.
+    """
+    suffix = oid.rsplit(".", 1)[-1]
+    if metric_name in INTERFACE_METRICS and suffix.isdigit():
+        return f"{INTERFACE_METRICS[metric_name]}.{suffix}", int(suffix)
+    if metric_name in SCALAR_METRICS:
+        return SCALAR_METRICS[metric_name][0], None
+    return oid, None
+
+
+def migrate(drop_old=False, timezone=None):
+    connection = connect_as_user()
+    cursor = connection.cursor()
+    cursor.execute(PROGRESS_SCHEMA)
+    if timezone is None:
+        cursor.execute("SELECT current_setting('TimeZone');")
+        timezone = cursor.fetchone()[0]
+    print(f"Reading old timestamps as {timezone} time")
+
+    # An snmp_samples table created before partitioning was added is moved
+    # aside and copied into the partitioned table below
+    cursor.execute("SELECT relkind FROM pg_class WHERE relname = 'snmp_samples';")
+    row = cursor.fetchone()
+    if row is not None and row[0] == "r":
+        cursor.execute("ALTER TABLE snmp_samples RENAME TO snmp_samples_unpartitioned;")
+        cursor.execute("ALTER INDEX IF EXISTS snmp_samples_metric_device_ts_idx "
+                       "RENAME TO snmp_samples_unpartitioned_idx;")
+        print("Moved unpartitioned 'snmp_samples' aside.")
+    # Also true on a rerun after the table was moved aside
+    cursor.execute("SELECT to_regclass('snmp_samples_unpartitioned') IS NOT NULL;")
+    unpartitioned = cursor.fetchone()[0]
+
+    cursor.execute(TABLE_SCHEMA)
+    ensure_partitions(connection)
+
+    cursor.execute("SELECT to_regclass('snmp_critical_metrics') IS NOT NULL;")
+    has_legacy = cursor.fetchone()[0]
+    if has_legacy:
+        copy_legacy_table(connection, cursor, timezone)
+    if unpartitioned:
+        copy_unpartitioned_table(connection, cursor, timezone)
+
+    cursor.execute("ANALYZE snmp_samples;")
+    backfill_last_sample(connection, cursor)
+    if drop_old:
+        if has_legacy:
+            cursor.execute("DROP TABLE snmp_critical_metrics;")
+            print("Dropped table 'snmp_critical_metrics'.")
+        if unpartitioned:
+            cursor.execute("DROP TABLE snmp_samples_unpartitioned;")
+            print("Dropped table 'snmp_samples_unpartitioned'.")
+    connection.commit()
+
+    cursor.close()
+    connection.close()
+    print("Migration finished.")
+
+
+# Function to fill snmp_devices.last_sample for devices that already have samples
+def backfill_last_sample(connection, cursor):
+    """
+    The column was added after samples were first written; until every
+    device has a value the API would take the newest of the few that do
+    as the latest sample.
+    """
+    # One pass over the samples; a newer value the collector already wrote is kept
+    cursor.execute("""
+        UPDATE snmp_devices d
+        SET last_sample = GREATEST(d.last_sample, s.latest)
+        FROM (SELECT device_id, MAX(timestamp) AS latest FROM snmp_samples GROUP BY device_id) s
+        WHERE s.device_id = d.device_id;
+    """)
+    connection.commit()
+    print(f"Filled last_sample for {cursor.rowcount} device(s)")
+
+
+# Function to read how far a source table has been copied
+def copied_until(cursor, source):
+    cursor.execute("SELECT next_id FROM snmp_migration_progress WHERE source = %s;", (source,))
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+# Function to create the daily partitions a source table's rows will land in
+def create_partitions_for(connection, cursor, table, timezone):
+    utc = TO_UTC.format(column="timestamp")
+    cursor.execute(f"SELECT MIN({utc})::date, MAX({utc})::date FROM {table};", (timezone, timezone))
+    first_day, last_day = cursor.fetchone()
+    if first_day is not None:
+        create_partitions(cursor, first_day, last_day)
+        connection.commit()
+
+
+# Function to copy a pre-partitioning snmp_samples table
+def copy_unpartitioned_table(connection, cursor, timezone):
+    source = "snmp_samples_unpartitioned"
+    if copied_until(cursor, source) is not None:
+        print(f"'{source}' was already copied")
+        return
+    create_partitions_for(connection, cursor, source, timezone)
+    cursor.execute(f"""
+        INSERT INTO snmp_samples (metric_id, device_id, timestamp, value)
+        SELECT metric_id, device_id, {TO_UTC.format(column="timestamp")}, value FROM {source};
+    """, (timezone,))
+    copied = cursor.rowcount
+    # The table has no ids; any row marks it as copied
+    cursor.execute(PROGRESS_QUERY, (source, 0))
+    connection.commit()
+    print(f"Copied {copied} sample(s) from '{source}'")
+
+
+# Function to copy the original snmp_critical_metrics table
+def copy_legacy_table(connection, cursor, timezone):
+    create_partitions_for(connection, cursor, "snmp_critical_metrics", timezone)
+
+    # Devices
+    cursor.execute("""
+        INSERT INTO snmp_devices (ip_port)
+        SELECT DISTINCT trim(ip_port) FROM snmp_critical_metrics WHERE ip_port IS NOT NULL
+        ON CONFLICT (ip_port) DO NOTHING;
+    """)
+
+    # Metrics, plus a map from every old (metric_name, oid) spelling to its metric_id
+    cursor.execute("SELECT DISTINCT metric_name, oid, value_type FROM snmp_critical_metrics;")
+    legacy = cursor.fetchall()
+    cursor.execute("""
+        CREATE TEMPORARY TABLE legacy_metric_map (
+            metric_name VARCHAR(255),
+            oid VARCHAR(255),
+            metric_id INTEGER
+        );
+    """)
+    mapping = []
+    for metric_name, oid, value_type in legacy:
+        new_oid, if_index = normalize_metric(metric_name.strip(), oid)
+        cursor.execute("""
+            INSERT INTO snmp_metrics (metric_name, oid, if_index, value_type)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (oid) DO UPDATE SET metric_name = EXCLUDED.metric_name
+            RETURNING metric_id;
+        """, (metric_name.strip(), new_oid, if_index, value_type))
+        mapping.append((metric_name, oid, cursor.fetchone()[0]))
+    execute_values(cursor, "INSERT INTO legacy_metric_map VALUES %s", mapping)
+    connection.commit()
+    print(f"Mapped {len(mapping)} legacy metric/OID pair(s)")
+
+    # Samples, copied in id ranges so each transaction stays bounded
+    cursor.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), -1) FROM snmp_critical_metrics;")
+    first_id, last_id = cursor.fetchone()
+    next_id = copied_until(cursor, "snmp_critical_metrics")
+    if next_id is not None:
+        print(f"Resuming the copy of 'snmp_critical_metrics' at id {next_id}")
+        first_id = max(first_id, next_id)
+    copied = 0
+    for start in range(first_id, last_id + 1, BATCH_ROWS):
+        cursor.execute(f"""
+            INSERT INTO snmp_samples (metric_id, device_id, timestamp, value)
+            SELECT m.metric_id, d.device_id, {TO_UTC.format(column="o.timestamp")},
+                   trim(o.value)::double precision
+            FROM snmp_critical_metrics o
+            JOIN legacy_metric_map m ON m.metric_name = o.metric_name AND m.oid = o.oid
+            JOIN snmp_devices d ON d.ip_port = trim(o.ip_port)
+            WHERE o.id >= %s AND o.id < %s
+              AND o.timestamp IS NOT NULL
+              AND trim(o.value) ~ '^-?[0-9]+(\\.[0-9]+)?$';
+        """, (timezone, start, start + BATCH_ROWS))
+        copied += cursor.rowcount
+        cursor.execute(PROGRESS_QUERY, ("snmp_critical_metrics", start + BATCH_ROWS))
+        connection.commit()
+        print(f"Copied {copied} sample(s) (up to id {min(start + BATCH_ROWS - 1, last_id)})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Copy data from snmp_critical_metrics (or an unpartitioned snmp_samples) "
+                    "into the partitioned snmp_samples schema."
+    )
+    parser.add_argument("--drop-old", action="store_true",
+                        help="drop the old tables once the copy has finished")
+    parser.add_argument("--timezone",
+                        help="time zone the old tables' timestamps were written in, e.g. Europe/Berlin "
+                             "(default: the database server's TimeZone setting)")
+    args = parser.parse_args()
+    migrate(drop_old=args.drop_old, timezone=args.timezone)
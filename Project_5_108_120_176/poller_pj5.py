@@ -0,0 +1,406 @@
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from pysnmp.hlapi import (
+    CommunityData,
+    ContextData,
+    EndOfMibView,
+    NoSuchInstance,
+    NoSuchObject,
+    ObjectIdentity,
+    ObjectType,
+    SnmpEngine,
+    UdpTransportTarget,
+    getCmd,
+)
+from pysnmp.proto.errind import RequestTimedOut
+
+from discovery_pj5 import InterfaceCache
+from stats_pj5 import CollectorStats
+
+# Default location of the device inventory (next to this file)
+INVENTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "devices.json")
+
+# Defaults used when an inventory entry leaves a field out
+DEFAULT_PORT = 161
+DEFAULT_COMMUNITY = "public"
+DEFAULT_INTERVAL = 60      # seconds between polls of one device
+DEFAULT_TIMEOUT = 2        # seconds per SNMP request
+DEFAULT_RETRIES = 1
+DEFAULT_POLL_BUDGET = 30   # seconds a single device poll may take in total
+DEFAULT_MAX_MSG_SIZE = 1472  # bytes; largest SNMP message that fits one Ethernet frame
+
+# Rough BER sizes used to estimate how many varbinds fit in one message
+MSG_OVERHEAD = 64          # version, community, PDU header, request id, error fields
+VARBIND_OVERHEAD = 16      # varbind sequence plus the largest value (Counter64)
+
+# SNMP errorStatus value returned when the response would not fit
+TOO_BIG = 1
+
+# Values an agent returns for OIDs it does not have
+MISSING_VALUE_TYPES = (NoSuchInstance, NoSuchObject, EndOfMibView)
+
+# Upper bound on devices polled at the same time
+MAX_WORKERS = 32
+
+# Each poll starts up to this many seconds after its tick, at random, so
+# collectors sharing agents or links do not fire in lockstep
+TICK_JITTER = 1.0
+
+Device = namedtuple(
+    "Device",
+    ["ip", "port", "community", "interval", "timeout", "retries", "max_msg_size"],
+)
+
+# timestamp is when the agent was read (epoch seconds)
+Sample = namedtuple(
+    "Sample",
+    ["metric_name", "oid", "value", "value_type", "ip_port", "if_index", "timestamp"],
+    defaults=[None, None],
+)
+
+
+def device_ip_port(device):
+    return f"{device.ip}:{device.port}"
+
+
+def estimate_varbind_size(oid):
+    """Approximate encoded size of one varbind in a GET response."""
+    arcs = [int(arc) for arc in oid.strip(".").split(".")]
+    # The first two arcs share a byte; larger arcs need one byte per 7 bits
+    encoded = 1 + sum(max(1, (arc.bit_length() + 6) // 7) for arc in arcs[2:])
+    return encoded + 2 + VARBIND_OVERHEAD
+
+
+# Function to split OIDs into batches that fit the agent's message size
+def pack_oids(oids, max_msg_size, max_varbinds=None):
+    batches = []
+    batch = []
+    size = MSG_OVERHEAD
+    for oid in oids:
+        oid_size = estimate_varbind_size(oid)
+        full = size + oid_size > max_msg_size or (max_varbinds and len(batch) >= max_varbinds)
+        if batch and full:
+            batches.append(batch)
+            batch = []
+            size = MSG_OVERHEAD
+        batch.append(oid)
+        size += oid_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# Function to load the device inventory from a JSON file
+def load_inventory(path=INVENTORY_FILE):
+    """
+    Reads a JSON list of devices. Each entry needs an "ip" and may set
+    "port", "community", "interval", "timeout", "retries" and "max_msg_size".
+    Raises ValueError naming the entry if a field is out of range.
+    """
+    with open(path) as f:
+        entries = json.load(f)
+
+    devices = []
+    for number, entry in enumerate(entries, 1):
+        device = Device(
+            ip=entry["ip"],
+            port=int(entry.get("port", DEFAULT_PORT)),
+            community=entry.get("community", DEFAULT_COMMUNITY),
+            interval=float(entry.get("interval", DEFAULT_INTERVAL)),
+            timeout=float(entry.get("timeout", DEFAULT_TIMEOUT)),
+            retries=int(entry.get("retries", DEFAULT_RETRIES)),
+            max_msg_size=int(entry.get("max_msg_size", DEFAULT_MAX_MSG_SIZE)),
+        )
+        where = f"{path}: device {number} ({device_ip_port(device)})"
+        if device.interval <= 0:
+            raise ValueError(f"{where}: interval must be greater than 0, got {device.interval}")
+        if device.timeout < 0:
+            raise ValueError(f"{where}: timeout must not be negative, got {device.timeout}")
+        if device.retries < 0:
+            raise ValueError(f"{where}: retries must not be negative, got {device.retries}")
+        devices.append(device)
+    return devices
+
+
+class DeviceSession:
+    """
+    Holds the SNMP engine, credentials and transport for one device so they
+    are built once and reused for every request to that device.
+
+    A session must only be used by one thread at a time.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.engine = SnmpEngine()
+        self.auth = CommunityData(device.community)
+        self.transport = UdpTransportTarget(
+            (device.ip, device.port),
+            timeout=device.timeout,
+            retries=device.retries,
+        )
+        self.context = ContextData()
+        # Learned from tooBig responses, or from smaller requests answered
+        # after a larger one timed out; None until the agent pushes back
+        self.max_varbinds = None
+        # max_varbinds came from timeouts, so it is raised again after clean polls
+        self.timeout_limited = False
+
+    @property
+    def ip_port(self):
+        return device_ip_port(self.device)
+
+    def get_many(self, oids, deadline=None, timestamps=None):
+        """
+        Fetches many OIDs with as few GET PDUs as the agent's message size
+        allows. Returns {oid: (value, value_type)} for every OID the agent
+        answered; missing OIDs are left out. If `timestamps` is a dict it
+        gets the time each OID was read: the midpoint of its request.
+
+        A PDU that fails with tooBig is split in half and each half retried,
+        and the smaller size is remembered for later calls. A PDU that times
+        out after other PDUs of this call were answered is retried in halves
+        too, but the size is only lowered once a half is answered; a timeout
+        before any answer means the device is down until its next tick. A
+        size learned from timeouts is doubled again after every clean call.
+        """
+        results = {}
+        # (batch, whether it is half of a batch that timed out)
+        pending = [(batch, False) for batch in pack_oids(oids, self.device.max_msg_size, self.max_varbinds)]
+        answered = False
+        clean = True
+
+        while pending:
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            batch, probe = pending.pop(0)
+            sent = time.time()
+            try:
+                errorIndication, errorStatus, errorIndex, varBinds = next(getCmd(
+                    self.engine,
+                    self.auth,
+                    self.transport,
+                    self.context,
+                    *[ObjectType(ObjectIdentity(oid)) for oid in batch],
+                    lookupMib=False
+                ))
+            except Exception as e:
+                print(f"Error fetching SNMP data from {self.ip_port}: {e}")
+                break
+
+            if errorIndication:
+                clean = False
+                # A silent agent is down until its next tick. One that has
+                # answered other PDUs of this call may just be dropping large
+                # ones: retry the halves
+                timed_out = isinstance(errorIndication, RequestTimedOut) and len(batch) > 1
+                if timed_out and answered:
+                    pending[:0] = [(half, True) for half in self._halves(batch)]
+                    continue
+                print(f"SNMP Error ({self.ip_port}): {errorIndication}")
+                break
+
+            answered = True
+            if probe and (self.max_varbinds is None or len(batch) < self.max_varbinds):
+                self.max_varbinds = len(batch)
+                self.timeout_limited = True
+            if errorStatus:
+                clean = False
+                if int(errorStatus) == TOO_BIG and len(batch) > 1:
+                    halves = self._halves(batch)
+                    self.max_varbinds = min(self.max_varbinds or len(batch), len(halves[0]))
+                    self.timeout_limited = False
+                    pending[:0] = [(half, False) for half in halves]
+                elif errorIndex and len(batch) > 1:
+                    # SNMPv1-style failure on one varbind: drop it, keep the rest
+                    bad = int(errorIndex) - 1
+                    pending.insert(0, (batch[:bad] + batch[bad + 1:], probe))
+                else:
+                    print(f"SNMP Error ({self.ip_port}): {errorStatus.prettyPrint()}")
+                continue
+
+            read_at = (sent + time.time()) / 2
+            for oid, value in varBinds:
+                if isinstance(value, MISSING_VALUE_TYPES):
+                    continue
+                results[str(oid)] = (str(value), type(value).__name__)
+                if timestamps is not None:
+                    timestamps[str(oid)] = read_at
+
+        if clean and not pending and self.timeout_limited:
+            self.max_varbinds *= 2
+            if self.max_varbinds >= len(oids):
+                self.max_varbinds = None
+                self.timeout_limited = False
+        return results
+
+    @staticmethod
+    def _halves(batch):
+        half = len(batch) // 2
+        return [batch[:half], batch[half:]]
+
+
+# Function to build the OIDs polled from one device
+def device_oids(interface_metrics, scalar_metrics, interfaces):
+    """
+    Returns {oid: (metric_name, if_index)}: every scalar metric plus one
+    OID per interface column for each interface that is up.
+    """
+    metric_for_oid = {}
+    for metric_name, oids in scalar_metrics.items():
+        for oid in oids:
+            metric_for_oid[oid] = (metric_name, None)
+    if interfaces is not None:
+        for metric_name, base_oid in interface_metrics.items():
+            for index in interfaces.up:
+                metric_for_oid[f"{base_oid}.{index}"] = (metric_name, index)
+    return metric_for_oid
+
+
+# Function to poll every metric of one device
+def poll_device(session, interface_metrics, scalar_metrics, interface_cache, budget=DEFAULT_POLL_BUDGET):
+    """
+    Fetches every scalar metric and the interface counters of the device's
+    up interfaces in batched GETs and returns (samples, skipped). Stops early
+    once `budget` seconds are used so one dead device cannot hold a worker
+    for the whole round.
+    """
+    deadline = time.monotonic() + budget
+    interfaces = interface_cache.get(session)
+    metric_for_oid = device_oids(interface_metrics, scalar_metrics, interfaces)
+
+    check_oids = InterfaceCache.check_oids(interfaces) if interfaces is not None else []
+    timestamps = {}
+    results = session.get_many(list(metric_for_oid) + check_oids, deadline=deadline, timestamps=timestamps)
+    if interfaces is not None and results:
+        interface_cache.check(session.ip_port, interfaces, results)
+
+    samples = []
+    for oid, (metric_name, if_index) in metric_for_oid.items():
+        if oid in results:
+            value, value_type = results[oid]
+            samples.append(Sample(metric_name, oid, value, value_type, session.ip_port, if_index,
+                                  timestamps[oid]))
+
+    return samples, len(metric_for_oid) - len(samples)
+
+
+class Poller:
+    """
+    Polls many devices concurrently with a bounded thread pool. Each device
+    keeps one DeviceSession for the lifetime of the poller.
+
+    Every device is polled on fixed wall-clock ticks, phase + k * interval,
+    so a slow poll never pushes later ones back. Phases come from a hash of
+    the device's address, which spreads the devices' requests over the
+    interval and keeps a device on the same ticks whichever collector
+    process polls it.
+    A device that is still busy when its next tick comes skips that tick
+    (an overrun), and ticks that pass while the scheduler is late are
+    skipped rather than polled in a burst; both are counted in stats.
+
+    Finished samples are handed to `on_samples` from the worker thread.
+    """
+
+    def __init__(self, devices, interface_metrics, scalar_metrics, max_workers=MAX_WORKERS,
+                 budget=DEFAULT_POLL_BUDGET, stats=None, on_samples=None):
+        self.stats = stats or CollectorStats()
+        self.on_samples = on_samples or (lambda samples: None)
+        self.interface_metrics = interface_metrics
+        self.scalar_metrics = scalar_metrics
+        self.interface_cache = InterfaceCache()
+        self.budget = budget
+        self.sessions = {}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.lock = threading.Lock()
+        self.in_flight = set()
+        # ip_port -> next tick, and -> when that tick's poll actually starts
+        self.next_tick = {}
+        self.next_start = {}
+        self.set_devices(devices)
+
+    def set_devices(self, devices, delay=0.0):
+        """
+        Replaces the set of devices polled. Devices already polled keep
+        their session and schedule; a poll in flight for a removed device
+        is left to finish. New devices are first polled on their first tick
+        at least `delay` seconds from now.
+        """
+        wanted = {device_ip_port(d): d for d in devices}
+        for ip_port in list(self.sessions):
+            if ip_port not in wanted:
+                del self.sessions[ip_port]
+                del self.next_tick[ip_port]
+                del self.next_start[ip_port]
+                self.interface_cache.invalidate(ip_port)
+        now = time.time() + delay
+        for ip_port, device in wanted.items():
+            if ip_port in self.sessions:
+                continue
+            self.sessions[ip_port] = DeviceSession(device)
+            phase = device.interval * zlib.crc32(ip_port.encode()) / 2 ** 32
+            # First tick at or after now that falls on this device's phase
+            self._schedule(ip_port, now + (phase - now) % device.interval)
+
+    def _schedule(self, ip_port, tick):
+        self.next_tick[ip_port] = tick
+        self.next_start[ip_port] = tick + random.uniform(0, TICK_JITTER)
+
+    def seconds_until_due(self):
+        return max(0.0, min(self.next_start.values(), default=0.0) - time.time())
+
+    def start_due(self, now=None):
+        """Starts the poll of every device whose tick has come; returns how many started."""
+        now = time.time() if now is None else now
+        started = 0
+        for ip_port, session in self.sessions.items():
+            if self.next_start[ip_port] > now:
+                continue
+            tick = self.next_tick[ip_port]
+            interval = session.device.interval
+            missed = int((now - tick) // interval)
+            self._schedule(ip_port, tick + (missed + 1) * interval)
+            if missed:
+                self.stats.add_cycles(missed=missed)
+                print(f"Warning: scheduler fell behind; skipped {missed} tick(s) of {ip_port}")
+
+            with self.lock:
+                busy = ip_port in self.in_flight
+                if not busy:
+                    self.in_flight.add(ip_port)
+            if busy:
+                self.stats.add_cycles(overruns=1)
+                print(f"Warning: {ip_port} is still being polled from its last tick; skipping this one")
+                continue
+            self.executor.submit(self._poll, session)
+            started += 1
+        return started
+
+    def _poll(self, session):
+        started = time.monotonic()
+        try:
+            samples, skipped = poll_device(
+                session,
+                self.interface_metrics,
+                self.scalar_metrics,
+                self.interface_cache,
+                self.budget,
+            )
+            self.stats.add(collected=len(samples), skipped=skipped)
+            self.on_samples(samples)
+        except Exception as e:
+            print(f"Error polling {session.ip_port}: {e}")
+        finally:
+            self.stats.observe_poll(session.ip_port, time.monotonic() - started)
+            with self.lock:
+                self.in_flight.discard(session.ip_port)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,175 @@
+import argparse
+import hashlib
+import os
+import socket
+import time
+
+from db_pj5 import COLLECTOR_SCHEMA, connect_as_user
+
+# Seconds between heartbeats of one collector process
+HEARTBEAT_INTERVAL = 10
+# A collector that has not sent a heartbeat for this long is taken as dead
+# and its devices are handed to the others
+LEASE_TTL = 30
+# Rows of collectors dead for this long are removed
+LEASE_EXPIRY = 3600
+# Seconds a collector waits before polling a device it gained while other
+# collectors are alive: the one that polled it until now only lets go at
+# its next heartbeat, and until then both would poll the same ticks and
+# write the same samples twice. Covers a heartbeat interval plus the
+# scheduler's one-second tick
+HANDOVER_DELAY = HEARTBEAT_INTERVAL + 2
+
+HEARTBEAT_QUERY = """
+    INSERT INTO snmp_collector_leases AS l
+        (worker_id, heartbeat, started, devices, collected, inserted, samples_per_second)
+    VALUES (%s, LOCALTIMESTAMP, LOCALTIMESTAMP, %s, %s, %s, %s)
+    ON CONFLICT (worker_id) DO UPDATE SET
+        heartbeat = EXCLUDED.heartbeat,
+        devices = EXCLUDED.devices,
+        collected = EXCLUDED.collected,
+        inserted = EXCLUDED.inserted,
+        samples_per_second = EXCLUDED.samples_per_second;
+"""
+
+LIVE_WORKERS_QUERY = """
+    SELECT worker_id FROM snmp_collector_leases
+    WHERE heartbeat > LOCALTIMESTAMP - make_interval(secs => %s)
+    ORDER BY worker_id;
+"""
+
+EXPIRE_QUERY = """
+    DELETE FROM snmp_collector_leases
+    WHERE heartbeat < LOCALTIMESTAMP - make_interval(secs => %s);
+"""
+
+STATUS_QUERY = """
+    SELECT worker_id, heartbeat > LOCALTIMESTAMP - make_interval(secs => %s) AS alive,
+           heartbeat, started, devices, collected, inserted, samples_per_second
+    FROM snmp_collector_leases
+    ORDER BY worker_id;
+"""
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# Function to pick the collector that owns a device (rendezvous hashing)
+def owner(ip_port, workers):
+    """
+    Every collector computes the same answer from the same list of live
+    workers, and when a worker joins or leaves only the devices it gains
+    or loses move.
+    """
+    return max(workers, key=lambda worker: hashlib.md5(f"{worker}/{ip_port}".encode()).digest())
+
+
+class ShardMembership:
+    """
+    Splits the device inventory between collector processes through the
+    snmp_collector_leases table. Each process heartbeats its row; the live
+    rows decide who polls which device, so when a process dies its devices
+    move to the others once its lease runs out.
+
+    The row also carries the process's throughput, see `status`.
+
+    A device that changes hands is only polled by its new owner after
+    HANDOVER_DELAY, so the two never poll it at once. Alert state (EWMA
+    baselines, "for" streaks) stays with the process that built it: the
+    new owner starts the device's series from scratch, warmup included.
+    """
+
+    def __init__(self, connect, worker_id=None, stats=None):
+        self.connect = connect
+        self.worker_id = worker_id or default_worker_id()
+        self.stats = stats
+        self.connection = None
+        self.workers = [self.worker_id]
+        self.last_heartbeat = None
+        self.last_inserted = 0
+
+    def heartbeat_due(self):
+        return self.last_heartbeat is None or time.monotonic() - self.last_heartbeat >= HEARTBEAT_INTERVAL
+
+    def heartbeat(self, devices):
+        """
+        Renews this process's lease and returns the sorted live workers.
+        On a database error the last known list is returned.
+        """
+        now = time.monotonic()
+        collected = inserted = 0
+        rate = 0.0
+        if self.stats is not None:
+            collected, inserted = self.stats.collected, self.stats.inserted
+            if self.last_heartbeat is not None:
+                rate = (inserted - self.last_inserted) / (now - self.last_heartbeat)
+        try:
+            if self.connection is None:
+                self.connection = self.connect()
+                self.connection.cursor().execute(COLLECTOR_SCHEMA)
+            cursor = self.connection.cursor()
+            cursor.execute(HEARTBEAT_QUERY, (self.worker_id, devices, collected, inserted, rate))
+            cursor.execute(EXPIRE_QUERY, (LEASE_EXPIRY,))
+            cursor.execute(LIVE_WORKERS_QUERY, (LEASE_TTL,))
+            self.workers = [row[0] for row in cursor.fetchall()]
+            self.connection.commit()
+            cursor.close()
+        except Exception as e:
+            print(f"Error renewing collector lease: {e}")
+            self._reset()
+        self.last_heartbeat = now
+        self.last_inserted = inserted
+        return self.workers
+
+    def assign(self, devices, ip_port_of):
+        """The devices this process should poll."""
+        workers = self.workers if self.worker_id in self.workers else self.workers + [self.worker_id]
+        return [d for d in devices if owner(ip_port_of(d), workers) == self.worker_id]
+
+    def handover_delay(self):
+        """Seconds to wait before polling newly assigned devices."""
+        others = [worker for worker in self.workers if worker != self.worker_id]
+        return HANDOVER_DELAY if others else 0.0
+
+    def leave(self):
+        """Drops the lease so the other collectors take over right away."""
+        try:
+            if self.connection is not None:
+                cursor = self.connection.cursor()
+                cursor.execute("DELETE FROM snmp_collector_leases WHERE worker_id = %s;", (self.worker_id,))
+                self.connection.commit()
+        except Exception as e:
+            print(f"Error releasing collector lease: {e}")
+        self._reset()
+
+    def _reset(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+
+
+# Function to print every collector and its throughput
+def status(connection):
+    cursor = connection.cursor()
+    cursor.execute(STATUS_QUERY, (LEASE_TTL,))
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows:
+        print("No collectors have registered.")
+        return
+    print(f"{'worker':<32} {'state':<6} {'devices':>7} {'inserted':>12} {'samples/s':>10}  last heartbeat")
+    for worker_id, alive, heartbeat, _, devices, _, inserted, rate in rows:
+        state = "alive" if alive else "dead"
+        print(f"{worker_id:<32} {state:<6} {devices:>7} {inserted:>12} {rate:>10.1f}  {heartbeat:%Y-%m-%d %H:%M:%S}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the collector processes sharing the inventory.")
+    parser.parse_args()
+    connection = connect_as_user()
+    status(connection)
+    connection.close()
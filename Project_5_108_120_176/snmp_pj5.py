@@ -1,122 +1,221 @@
-import psycopg2
-from pysnmp.hlapi import *
-import time
-
-# Database connection parameters
-DB_NAME = "mib"
-DB_USER = "user_management"
-DB_PASSWORD = "management"
-DB_HOST = "localhost"
-DB_PORT = "5432"
-
-
-def get_dynamic_oids(base_oid, num_interfaces):
-    return [f"{base_oid}.{i}" for i in range(1, num_interfaces + 1)]
-
-# Dynamically fetch number of interfaces
-NUM_INTERFACES = 10  # Replace with dynamic detection if possible
-
-CRITICAL_METRICS = {
-    "Bandwidth In": get_dynamic_oids("1.3.6.1.2.1.2.2.1.10", NUM_INTERFACES),
-    "Bandwidth Out": get_dynamic_oids("1.3.6.1.2.1.2.2.1.16", NUM_INTERFACES),
-    "Input Errors": get_dynamic_oids("1.3.6.1.2.1.2.2.1.14", NUM_INTERFACES),
-    "Output Errors": get_dynamic_oids("1.3.6.1.2.1.2.2.1.20", NUM_INTERFACES),
-    "System Uptime": ["1.3.6.1.2.1.1.3.0"],
-    "IP Packets Received": ["1.3.6.1.2.1.4.3.0"],
-    "UDP Datagrams Sent": ["1.3.6.1.2.1.7.4.0"],
-    "TCP Connections": ["1.3.6.1.2.1.6.9.0"],
-    "Incoming IP Errors": ["1.3.6.1.2.1.4.5.0"],
-}
-
-
-# Function to connect to the database
-def connect_to_database():
-    return psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
-
-# Function to insert data into the database
-def insert_metric(connection, metric_name, oid, value, value_type, ip_port):
-    try:
-        cursor = connection.cursor()
-        query = """
-            INSERT INTO snmp_critical_metrics (metric_name, oid, value, value_type, ip_port)
-            VALUES (%s, %s, %s, %s, %s);
-        """
-        cursor.execute(query, (metric_name, oid, value, value_type, ip_port))
-        connection.commit()
-        cursor.close()
-        print(f"Recorded {metric_name}: {value} from {ip_port}")
-    except Exception as e:
-        print(f"Error inserting data: {e}")
-
-# Function to fetch SNMP data
-def fetch_snmp_data(target, community, oid):
-    try:
-        for errorIndication, errorStatus, errorIndex, varBinds in getCmd(
-            SnmpEngine(),
-            CommunityData(community),
-            UdpTransportTarget((target, 161)),
-            ContextData(),
-            ObjectType(ObjectIdentity(oid))
-        ):
-            if errorIndication:
-                print(f"SNMP Error: {errorIndication}")
-                return None
-            elif errorStatus:
-                print(f"SNMP Error: {errorStatus.prettyPrint()}")
-                return None
-            else:
-                for varBind in varBinds:
-                    oid, value = varBind
-                    return oid.prettyPrint(), str(value), type(value).__name__
-    except Exception as e:
-        print(f"Error fetching SNMP data: {e}")
-        return None
-
-# Main function to collect and record data
-def main():
-    target = "127.0.0.1"
-    community = "public"
-
-    # Connect to the database
-    connection = connect_to_database()
-
-    try:
-        while True:
-            for metric_group, oids in CRITICAL_METRICS.items():  # `oids` is a list
-                for oid in oids:  # Iterate over the list
-                    snmp_data = fetch_snmp_data(target, community, oid)
-
-                    # Debugging: Count rows in the database
-                    cursor = connection.cursor()
-                    cursor.execute("SELECT COUNT(*) FROM snmp_critical_metrics;")
-                    row_count = cursor.fetchone()[0]
-                    print(f"Total rows in snmp_critical_metrics: {row_count}")
-                    cursor.close()
-
-                    if snmp_data:
-                        oid, value, value_type = snmp_data
-                        insert_metric(
-                            connection,
-                            f"{metric_group}",
-                            oid,
-                            value,
-                            value_type,
-                            f"{target}:161"
-                        )
-                    else:
-                        print(f"Skipped metric {metric_group} for OID {oid} due to missing data.")
-            # Wait 60 seconds before the next round
-            time.sleep(60)
-    except KeyboardInterrupt:
-        print("Exiting program...")
-    finally:
-        connection.close()
-
-if __name__ == "__main__":
-    main()
+import argparse
+import multiprocessing
+import os
+import psycopg2
+import psycopg2.pool
+import time
+
+from alerts_pj5 import STATE_FILE, AlertEvaluator, load_rules
+from db_pj5 import ensure_partitions
+from poller_pj5 import (
+    DEFAULT_COMMUNITY,
+    DEFAULT_MAX_MSG_SIZE,
+    DEFAULT_PORT,
+    Device,
+    Poller,
+    device_ip_port,
+    load_inventory,
+    INVENTORY_FILE,
+)
+from shard_pj5 import ShardMembership
+from spool_pj5 import SPOOL_FILE, Spool
+from stats_pj5 import METRICS_PORT, CollectorStats, start_metrics_server
+from writer_pj5 import MetricWriter
+
+# Database connection parameters
+DB_NAME = "mib"
+DB_USER = "user_management"
+DB_PASSWORD = "management"
+DB_HOST = "localhost"
+DB_PORT = "5432"
+
+# Most connections the writer keeps open
+DB_POOL_SIZE = 4
+
+# Seconds between checks that upcoming daily partitions exist
+PARTITION_CHECK_INTERVAL = 3600
+
+# Longest sleep of the main loop, so logging and partition checks still run
+SCHEDULER_TICK = 1.0
+
+
+# ifTable columns polled for every interface that is up; the interfaces
+# themselves are discovered per device (see discovery_pj5.py)
+INTERFACE_METRICS = {
+    "Bandwidth In": "1.3.6.1.2.1.2.2.1.10",
+    "Bandwidth Out": "1.3.6.1.2.1.2.2.1.16",
+    "Input Errors": "1.3.6.1.2.1.2.2.1.14",
+    "Output Errors": "1.3.6.1.2.1.2.2.1.20",
+}
+
+SCALAR_METRICS = {
+    "System Uptime": ["1.3.6.1.2.1.1.3.0"],
+    "IP Packets Received": ["1.3.6.1.2.1.4.3.0"],
+    "UDP Datagrams Sent": ["1.3.6.1.2.1.7.4.0"],
+    "TCP Connections": ["1.3.6.1.2.1.6.9.0"],
+    "Incoming IP Errors": ["1.3.6.1.2.1.4.5.0"],
+}
+
+
+# Function to connect to the database
+def connect_to_database():
+    return psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+
+# Function to open the writer's connection pool; connections are opened on first use
+def create_pool():
+    return psycopg2.pool.ThreadedConnectionPool(
+        0,
+        DB_POOL_SIZE,
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+
+# Function to make sure upcoming daily partitions exist before samples arrive
+def check_partitions():
+    try:
+        connection = connect_to_database()
+        ensure_partitions(connection)
+        connection.close()
+    except Exception as e:
+        print(f"Error creating partitions: {e}")
+
+# Function to load the devices to poll
+def load_devices():
+    if os.path.exists(INVENTORY_FILE):
+        return load_inventory(INVENTORY_FILE)
+    # Fall back to the local agent when no inventory file is present
+    return [Device("127.0.0.1", DEFAULT_PORT, DEFAULT_COMMUNITY, 60, 2, 1, DEFAULT_MAX_MSG_SIZE)]
+
+# Function to pick this process's share of the devices and start polling them
+def rebalance(poller, membership, devices):
+    previous = list(membership.workers)
+    membership.heartbeat(len(poller.sessions))
+    mine = membership.assign(devices, device_ip_port)
+    if membership.workers != previous or len(mine) != len(poller.sessions):
+        print(f"Shard {membership.worker_id}: polling {len(mine)} of {len(devices)} device(s) "
+              f"with {len(membership.workers)} collector(s)")
+    # Devices gained from a live collector wait until it has let them go
+    poller.set_devices(mine, delay=membership.handover_delay())
+
+# Main function to collect and record data
+def main(shard=False, worker_id=None, metrics_port=METRICS_PORT, spool_path=SPOOL_FILE,
+         alert_state_path=STATE_FILE):
+    """
+    With shard=True this process polls only its share of the inventory and
+    splits it with the other sharded collectors through the database.
+    Samples that cannot be written while the database is down are kept in
+    the spool at `spool_path`, which belongs to this process alone, as
+    does the alert state at `alert_state_path`; alert state is not handed
+    over with a device when the shards are rebalanced.
+    """
+    devices = load_devices()
+    stats = CollectorStats()
+    if metrics_port:
+        start_metrics_server(stats, port=metrics_port)
+
+    # Samples are written in batches from a background thread, and spooled
+    # to disk while the database is unreachable
+    pool = create_pool()
+    check_partitions()
+    partitions_checked = time.monotonic()
+    writer = MetricWriter(pool, Spool(spool_path), stats=stats)
+
+    # Alert rules are evaluated on each poll's samples before they are written
+    rules, webhook = load_rules()
+    alerts = AlertEvaluator(rules, webhook, state_path=alert_state_path, stats=stats)
+    if rules:
+        print(f"Alerting on {len(rules)} rule(s)")
+
+    def on_samples(samples):
+        alerts.observe(samples)
+        writer.write_many(samples)
+
+    # Devices are polled on their own ticks and hand their samples straight to the writer
+    membership = ShardMembership(connect_to_database, worker_id, stats) if shard else None
+    poller = Poller([] if shard else devices, INTERFACE_METRICS, SCALAR_METRICS,
+                    stats=stats, on_samples=on_samples)
+    if membership is None:
+        print(f"Polling {len(devices)} device(s)")
+
+    try:
+        while True:
+            if membership is not None and membership.heartbeat_due():
+                rebalance(poller, membership, devices)
+            poller.start_due()
+            stats.maybe_log()
+            alerts.maybe_checkpoint()
+
+            if time.monotonic() - partitions_checked > PARTITION_CHECK_INTERVAL:
+                check_partitions()
+                partitions_checked = time.monotonic()
+
+            # Wait until the next device is due
+            time.sleep(min(poller.seconds_until_due(), SCHEDULER_TICK))
+    except KeyboardInterrupt:
+        print("Exiting program...")
+    finally:
+        poller.close()
+        alerts.checkpoint()
+        # Flush whatever is still buffered before exiting
+        writer.close()
+        if membership is not None:
+            membership.leave()
+        print(f"Collector stats: {stats.summary()}")
+        pool.closeall()
+
+# Function to run several sharded collectors on this host
+def run_processes(count, worker_id=None, metrics_port=METRICS_PORT, spool_path=SPOOL_FILE,
+                  alert_state_path=STATE_FILE):
+    processes = []
+    root, ext = os.path.splitext(spool_path)
+    state_root, state_ext = os.path.splitext(alert_state_path)
+    for i in range(count):
+        process = multiprocessing.Process(
+            target=main,
+            kwargs={
+                "shard": True,
+                "worker_id": f"{worker_id}-{i}" if worker_id else None,
+                "metrics_port": metrics_port + i if metrics_port else None,
+                "spool_path": f"{root}-{i}{ext}",
+                "alert_state_path": f"{state_root}-{i}{state_ext}",
+            },
+            name=f"collector-{i}",
+        )
+        process.start()
+        processes.append(process)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Every child got the same interrupt and shuts down on its own
+        for process in processes:
+            process.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Poll the SNMP inventory into PostgreSQL.")
+    parser.add_argument("--shard", action="store_true",
+                        help="poll only this process's share of the inventory, shared with other --shard collectors")
+    parser.add_argument("--worker-id", help="name of this collector in the lease table (default host:pid)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="run this many sharded collectors on this host (implies --shard)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Prometheus endpoint port, 0 to disable; with --processes, process i uses port + i")
+    parser.add_argument("--spool", default=SPOOL_FILE,
+                        help="file that holds samples while the database is down; with --processes, "
+                             "process i uses name-i")
+    parser.add_argument("--alert-state", default=STATE_FILE,
+                        help="file the alert state is checkpointed to; with --processes, process i uses name-i")
+    args = parser.parse_args()
+    if args.processes > 1:
+        run_processes(args.processes, args.worker_id, args.metrics_port, args.spool, args.alert_state)
+    else:
+        main(args.shard, args.worker_id, args.metrics_port, args.spool, args.alert_state)
@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import threading
+import time
+
+from poller_pj5 import Sample
+
+# Default spool file, next to this file
+SPOOL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool.db")
+
+# Milliseconds SQLite waits for a lock before giving up
+BUSY_TIMEOUT = 30000
+
+SPOOL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    id INTEGER PRIMARY KEY,
+    metric_name TEXT NOT NULL,
+    oid TEXT NOT NULL,
+    value TEXT,
+    value_type TEXT,
+    ip_port TEXT NOT NULL,
+    if_index INTEGER,
+    timestamp REAL
+);
+"""
+
+APPEND_QUERY = """
+    INSERT INTO spool (metric_name, oid, value, value_type, ip_port, if_index, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?);
+"""
+
+PEEK_QUERY = """
+    SELECT id, metric_name, oid, value, value_type, ip_port, if_index, timestamp
+    FROM spool ORDER BY id LIMIT ?;
+"""
+
+
+class Spool:
+    """
+    Durable on-disk queue of samples that could not be written to
+    PostgreSQL yet, kept in an SQLite database in WAL mode. Samples are
+    appended in one transaction per batch and stay on disk until ack()
+    confirms they reached PostgreSQL, so a crash in between replays them
+    rather than losing them.
+
+    One spool belongs to one collector process.
+    """
+
+    def __init__(self, path=SPOOL_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT / 1000, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL;")
+        # WAL with synchronous=NORMAL survives a process crash; only a power
+        # loss can take the last few transactions with it
+        self.connection.execute("PRAGMA synchronous=NORMAL;")
+        self.connection.execute(SPOOL_SCHEMA)
+        self.connection.commit()
+        self.pending = self.connection.execute("SELECT COUNT(*) FROM spool;").fetchone()[0]
+
+    def __len__(self):
+        return self.pending
+
+    def append(self, samples):
+        # Unstamped samples get the spool time, not the much later replay time
+        now = time.time()
+        rows = [
+            (s.metric_name, s.oid, None if s.value is None else str(s.value), s.value_type,
+             s.ip_port, s.if_index, s.timestamp or now)
+            for s in samples
+        ]
+        if not rows:
+            return
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(APPEND_QUERY, rows)
+            self.pending += len(rows)
+
+    def peek(self, limit):
+        """Returns ([id], [Sample]) of the oldest `limit` spooled samples."""
+        with self.lock:
+            rows = self.connection.execute(PEEK_QUERY, (limit,)).fetchall()
+        return [row[0] for row in rows], [Sample(*row[1:]) for row in rows]
+
+    def ack(self, last_id):
+        """Drops every sample up to and including `last_id`."""
+        with self.lock:
+            with self.connection:
+                deleted = self.connection.execute("DELETE FROM spool WHERE id <= ?;", (last_id,)).rowcount
+            self.pending -= deleted
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
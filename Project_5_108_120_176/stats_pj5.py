@@ -0,0 +1,162 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Where the Prometheus text endpoint listens (set METRICS_PORT to None to disable)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9105
+
+# Seconds between summary log lines
+LOG_INTERVAL = 60
+
+# Upper bounds (seconds) of the per-device poll latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class CollectorStats:
+    """
+    In-process counters for the collector. Updated from the poller and
+    writer threads and read by the metrics endpoint and the log line, so
+    none of it touches the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.collected = 0
+        self.inserted = 0
+        self.failed = 0
+        self.skipped = 0
+        # Samples written to the local spool, written back from it, and still in it
+        self.spooled = 0
+        self.replayed = 0
+        self.spool_pending = 0
+        self.alerts = 0
+        self.polls = 0
+        # Ticks a device was still busy at, and ticks that passed unpolled
+        self.overruns = 0
+        self.missed_cycles = 0
+        self.poll_latency = {}
+        self.last_log = time.monotonic()
+
+    def add(self, collected=0, inserted=0, failed=0, skipped=0, spooled=0, replayed=0, alerts=0):
+        with self.lock:
+            self.collected += collected
+            self.inserted += inserted
+            self.failed += failed
+            self.skipped += skipped
+            self.spooled += spooled
+            self.replayed += replayed
+            self.alerts += alerts
+
+    def set_spool_pending(self, count):
+        with self.lock:
+            self.spool_pending = count
+
+    def observe_poll(self, ip_port, seconds):
+        with self.lock:
+            self.polls += 1
+            histogram = self.poll_latency.get(ip_port)
+            if histogram is None:
+                histogram = self.poll_latency[ip_port] = Histogram()
+            histogram.observe(seconds)
+
+    def add_cycles(self, overruns=0, missed=0):
+        with self.lock:
+            self.overruns += overruns
+            self.missed_cycles += missed
+
+    def summary(self):
+        with self.lock:
+            return (
+                f"collected={self.collected} inserted={self.inserted} failed={self.failed} "
+                f"skipped={self.skipped} spooled={self.spooled} replayed={self.replayed} "
+                f"spool_pending={self.spool_pending} polls={self.polls} "
+                f"overruns={self.overruns} missed_cycles={self.missed_cycles} alerts={self.alerts}"
+            )
+
+    def maybe_log(self):
+        """Prints the summary line at most once every LOG_INTERVAL seconds."""
+        now = time.monotonic()
+        if now - self.last_log >= LOG_INTERVAL:
+            self.last_log = now
+            print(f"Collector stats: {self.summary()}")
+
+    def render_prometheus(self):
+        with self.lock:
+            lines = []
+            for name, help_text, value in (
+                ("samples_collected_total", "Samples read from SNMP agents.", self.collected),
+                ("samples_inserted_total", "Samples written to PostgreSQL.", self.inserted),
+                ("samples_failed_total", "Samples lost to database errors.", self.failed),
+                ("samples_skipped_total", "OIDs that returned no data.", self.skipped),
+                ("samples_spooled_total", "Samples written to the local spool while the database was unavailable.",
+                 self.spooled),
+                ("samples_replayed_total", "Spooled samples written back to PostgreSQL.", self.replayed),
+                ("polls_total", "Completed device polls.", self.polls),
+                ("poll_overruns_total", "Ticks skipped because the previous poll of the device was still running.",
+                 self.overruns),
+                ("missed_cycles_total", "Ticks that passed before the scheduler could start them.",
+                 self.missed_cycles),
+                ("alerts_fired_total", "Alerts that started firing.", self.alerts),
+            ):
+                lines.append(f"# HELP snmp_collector_{name} {help_text}")
+                lines.append(f"# TYPE snmp_collector_{name} counter")
+                lines.append(f"snmp_collector_{name} {value}")
+
+            lines.append("# HELP snmp_collector_spool_pending Samples waiting in the local spool.")
+            lines.append("# TYPE snmp_collector_spool_pending gauge")
+            lines.append(f"snmp_collector_spool_pending {self.spool_pending}")
+
+            lines.append("# HELP snmp_collector_poll_duration_seconds Time to poll one device.")
+            lines.append("# TYPE snmp_collector_poll_duration_seconds histogram")
+            for ip_port, histogram in sorted(self.poll_latency.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'snmp_collector_poll_duration_seconds_bucket{{device="{ip_port}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'snmp_collector_poll_duration_seconds_bucket{{device="{ip_port}",le="+Inf"}} {histogram.count}'
+                )
+                lines.append(f'snmp_collector_poll_duration_seconds_sum{{device="{ip_port}"}} {histogram.sum}')
+                lines.append(f'snmp_collector_poll_duration_seconds_count{{device="{ip_port}"}} {histogram.count}')
+            return "\n".join(lines) + "\n"
+
+
+# Function to serve the counters as a Prometheus text endpoint
+def start_metrics_server(stats, host=METRICS_HOST, port=METRICS_PORT):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = stats.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Collector metrics at http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The web app's modules import each other as top-level modules, as when run next to app.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "web_int_pj5"))
@@ -0,0 +1,139 @@
+import pytest
+from pysnmp.proto.errind import RequestTimedOut
+from pysnmp.proto.rfc1902 import Counter32, Integer32
+
+import poller_pj5
+from poller_pj5 import (
+    MSG_OVERHEAD,
+    TOO_BIG,
+    Device,
+    DeviceSession,
+    estimate_varbind_size,
+    pack_oids,
+)
+
+OIDS = [f"1.3.6.1.2.1.2.2.1.10.{index}" for index in range(1, 41)]
+
+
+def message_size(batch):
+    return MSG_OVERHEAD + sum(estimate_varbind_size(oid) for oid in batch)
+
+
+def fitting(count):
+    """A max_msg_size that holds exactly `count` of the OIDS."""
+    return message_size(OIDS[:count])
+
+
+class FakeAgent:
+    """
+    Stands in for getCmd. Answers every OID with its position in OIDS,
+    unless `reply` returns "tooBig" or "timeout" for the batch.
+    """
+
+    def __init__(self, reply=lambda batch: None):
+        self.reply = reply
+        self.requests = []
+
+    def __call__(self, engine, auth, transport, context, *oids, lookupMib=True):
+        batch = list(oids)
+        self.requests.append(batch)
+        outcome = self.reply(batch)
+        if outcome == "timeout":
+            return iter([(RequestTimedOut(), Integer32(0), Integer32(0), [])])
+        if outcome == "tooBig":
+            return iter([(None, Integer32(TOO_BIG), Integer32(0), [])])
+        return iter([(None, Integer32(0), Integer32(0), [(oid, Counter32(OIDS.index(oid))) for oid in batch])])
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    agent = FakeAgent()
+    monkeypatch.setattr(poller_pj5, "getCmd", agent)
+    # The fake reads plain OID strings
+    monkeypatch.setattr(poller_pj5, "ObjectType", lambda identity: identity)
+    monkeypatch.setattr(poller_pj5, "ObjectIdentity", lambda oid: oid)
+    return agent
+
+
+def session_for(max_msg_size=65000):
+    return DeviceSession(Device("127.0.0.1", 161, "public", 60, 1, 0, max_msg_size))
+
+
+def sizes(agent):
+    return [len(batch) for batch in agent.requests]
+
+
+def test_pack_oids_fills_messages_in_order():
+    batches = pack_oids(OIDS, fitting(10))
+    assert [len(batch) for batch in batches] == [10, 10, 10, 10]
+    assert sum(batches, []) == OIDS
+    assert all(message_size(batch) <= fitting(10) for batch in batches)
+
+
+def test_pack_oids_caps_varbinds():
+    batches = pack_oids(OIDS, 65000, max_varbinds=15)
+    assert [len(batch) for batch in batches] == [15, 15, 10]
+
+
+def test_pack_oids_gives_an_oversized_oid_its_own_message():
+    assert pack_oids(OIDS[:3], 1) == [[oid] for oid in OIDS[:3]]
+
+
+def test_too_big_splits_and_remembers_the_size(agent):
+    agent.reply = lambda batch: "tooBig" if len(batch) > 12 else None
+    session = session_for()
+
+    assert len(session.get_many(OIDS)) == len(OIDS)
+    assert sizes(agent) == [40, 20, 10, 10, 20, 10, 10]
+    assert session.max_varbinds == 10
+    assert not session.timeout_limited
+
+    # tooBig is a hard limit: later polls use it and do not grow
+    agent.requests.clear()
+    assert len(session.get_many(OIDS)) == len(OIDS)
+    assert sizes(agent) == [10, 10, 10, 10]
+    assert session.max_varbinds == 10
+
+
+def test_timeout_after_an_answer_retries_halves(agent):
+    # The agent drops any message with more than 5 OIDs from the second half
+    agent.reply = lambda batch: "timeout" if sum(oid in OIDS[20:] for oid in batch) > 5 else None
+    session = session_for(fitting(20))
+
+    timestamps = {}
+    results = session.get_many(OIDS, timestamps=timestamps)
+    assert len(results) == len(OIDS)
+    assert set(timestamps) == set(OIDS)
+    assert sizes(agent) == [20, 20, 10, 5, 5, 10, 5, 5]
+    assert session.max_varbinds == 5
+    assert session.timeout_limited
+
+
+def test_timeout_before_any_answer_leaves_the_size_alone(agent):
+    agent.reply = lambda batch: "timeout"
+    session = session_for()
+
+    assert session.get_many(OIDS) == {}
+    # One request: the device counts as down until its next tick
+    assert sizes(agent) == [40]
+    assert session.max_varbinds is None
+
+
+def test_size_learned_from_timeouts_grows_back_after_an_outage(agent):
+    session = session_for()
+    session.max_varbinds = 5
+    session.timeout_limited = True
+
+    agent.reply = lambda batch: "timeout"
+    assert session.get_many(OIDS) == {}
+    assert session.max_varbinds == 5
+
+    agent.reply = lambda batch: None
+    seen = []
+    for _ in range(4):
+        agent.requests.clear()
+        assert len(session.get_many(OIDS)) == len(OIDS)
+        seen.append(max(sizes(agent)))
+    assert seen == [5, 10, 20, 40]
+    assert session.max_varbinds is None
+    assert not session.timeout_limited
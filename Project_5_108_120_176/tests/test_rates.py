@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from archive import series_rates
+from hotwindow import HotWindow
+from rates import UPTIME_METRIC, counter_delta
+
+START = 1700000000
+TIMES = [START + 10 * i for i in range(7)]
+
+# The agent restarts at START + 35: its counters start over and sysUpTime
+# (hundredths of a second) implies the new boot time from START + 40 on
+REBOOT = START + 35
+UPTIME = [(t - START + 1000) * 100 if t < REBOOT else (t - REBOOT) * 100 for t in TIMES]
+
+# Each counter wraps once before the restart
+SERIES = {
+    "Bandwidth In": ("Counter32", [2 ** 32 - 7296, 2 ** 32 - 2296, 1704, 6704, 300, 1300, 2300]),
+    "Bandwidth Out": ("Counter64", [2 ** 64 - 2 ** 21, 2 ** 64 - 2 ** 20, 2 ** 20, 2 ** 21, 1000, 3000, 5000]),
+}
+
+# (time, rate) per series; the interval across the restart has no rate
+EXPECTED = {
+    "Bandwidth In": [(TIMES[1], 500.0), (TIMES[2], 400.0), (TIMES[3], 500.0), (TIMES[5], 100.0), (TIMES[6], 100.0)],
+    "Bandwidth Out": [(TIMES[1], 2 ** 20 / 10), (TIMES[2], 2 ** 21 / 10), (TIMES[3], 2 ** 20 / 10),
+                      (TIMES[5], 200.0), (TIMES[6], 200.0)],
+}
+
+
+def to_datetime(t):
+    return datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None)
+
+
+def reference_rates(value_type, values):
+    """counter_delta on every pair, skipping the interval the restart falls in."""
+    rates = []
+    for (prev_t, prev_v), (t, v) in zip(zip(TIMES, values), zip(TIMES[1:], values[1:])):
+        if prev_t < REBOOT <= t:
+            continue
+        rates.append((t, counter_delta(v, prev_v, value_type) / (t - prev_t)))
+    return rates
+
+
+def hot_window_rates():
+    window = HotWindow()
+    rows = [(1, 100, UPTIME_METRIC, "TimeTicks", to_datetime(t), float(u)) for t, u in zip(TIMES, UPTIME)]
+    for metric_id, (name, (value_type, values)) in enumerate(SERIES.items(), 1):
+        rows += [(1, metric_id, name, value_type, to_datetime(t), float(v)) for t, v in zip(TIMES, values)]
+    window._add(sorted(rows, key=lambda row: row[4]))
+    # One-second buckets hold one interval each
+    series = window.rate_series(list(SERIES), to_datetime(TIMES[0]), to_datetime(TIMES[-1]), step=1)
+    return {name: list(zip(series[name].t, series[name].v)) for name in SERIES}
+
+
+def archive_rates(value_type, values):
+    uptime_t = np.array(TIMES, dtype=float)
+    boots = (uptime_t, uptime_t - np.array(UPTIME) / 100)
+    t, rates = series_rates(np.array(TIMES, dtype=float), np.array(values, dtype=float), value_type, boots)
+    return list(zip(t.tolist(), rates.tolist()))
+
+
+def assert_rates(actual, expected):
+    assert [t for t, _ in actual] == [t for t, _ in expected]
+    assert [rate for _, rate in actual] == pytest.approx([rate for _, rate in expected], rel=1e-12)
+
+
+def test_counter_delta_wraps():
+    assert counter_delta(1704, 2 ** 32 - 2296, "Counter32") == 4000
+    assert counter_delta(2 ** 20, 2 ** 64 - 2 ** 20, "Counter64") == 2 ** 21
+    assert counter_delta(5, 10, "Gauge32") is None
+    assert counter_delta(10, 5, "Gauge32") == 5
+
+
+@pytest.mark.parametrize("name", list(SERIES))
+def test_wrap_and_restart_rates_agree(name):
+    value_type, values = SERIES[name]
+    assert_rates(reference_rates(value_type, values), EXPECTED[name])
+    assert_rates(hot_window_rates()[name], EXPECTED[name])
+    assert_rates(archive_rates(value_type, values), EXPECTED[name])
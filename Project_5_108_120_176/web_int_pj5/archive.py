@@ -0,0 +1,358 @@
+# Cold tier for old samples.
+#
+# Closed days of snmp_samples are exported to ARCHIVE_DIR as two files per
+# day. YYYYMMDD.bin holds every series of the day as two columns, sample
+# times in milliseconds and values, each delta-encoded per series and
+# stored in the narrowest integer type its deltas fit (values that are not
+# whole numbers are kept as float64). YYYYMMDD.json is the small index of
+# series, offsets and types; it is written last, so a day only counts as
+# archived once both files are complete.
+#
+# Days are exported oldest first without gaps, so every range before the
+# end of the archive can be answered from it instead of PostgreSQL. Reads
+# memory-map the .bin file and decode only the series they need.
+#
+# Run `python archive.py` next to app.py to export every day older than
+# ARCHIVE_AFTER; add --drop to drop each day's partition once it is exported.
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, time, timedelta, timezone
+from itertools import groupby
+
+import numpy as np
+from sqlalchemy import text
+
+from rates import COUNTER32_MODULUS, COUNTER64_MODULUS, LOOKBACK, UPTIME_METRIC
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+
+# Days that ended longer ago than this are exported
+ARCHIVE_AFTER = timedelta(days=7)
+
+# Daily partitions of snmp_samples, named as in db_pj5.py
+PARTITION_PREFIX = "snmp_samples_p"
+
+# Parsed day indexes kept in memory
+INDEX_CACHE_DAYS = 62
+
+# Every segment in a .bin file starts on this boundary
+ALIGNMENT = 8
+
+# Whole numbers above this are not exact in float64 and are stored as float64
+MAX_EXACT = 2 ** 53
+
+# Narrowest first; at equal size signed is preferred
+INTEGER_TYPES = (np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32, np.int64)
+
+COUNTER_MODULUS = {"Counter32": COUNTER32_MODULUS, "Counter64": COUNTER64_MODULUS}
+
+DAY_SAMPLES_SQL = """
+    SELECT dev.ip_port, m.metric_name, m.oid, m.if_index, m.value_type,
+           FLOOR(EXTRACT(EPOCH FROM s.timestamp) * 1000)::bigint AS ms, s.value
+    FROM snmp_samples s
+    JOIN snmp_metrics m ON m.metric_id = s.metric_id
+    JOIN snmp_devices dev ON dev.device_id = s.device_id
+    WHERE s.timestamp >= :day AND s.timestamp < :next_day
+    ORDER BY s.device_id, s.metric_id, s.timestamp
+"""
+
+
+def to_epoch(timestamp):
+    """Epoch seconds of a naive database timestamp (read as UTC, like EXTRACT(EPOCH))."""
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def day_file(directory, day, extension):
+    return os.path.join(directory, f"{day:%Y%m%d}.{extension}")
+
+
+# Function to delta-encode one column of a series
+def encode_column(values, modulus=None):
+    """
+    Returns (first, modulus, deltas) with deltas in the narrowest integer
+    type that holds them and deltas[0] == 0, or (None, None, values as
+    float64) when the column is not made of exact whole numbers. With a
+    `modulus` (Counter32) and every value below it, deltas are taken
+    modulo it, so a counter wrap is a small step like any other.
+    """
+    if not len(values):
+        return 0, None, np.zeros(0, np.int8)
+    if not (np.all(np.isfinite(values)) and np.all(values == np.round(values))
+            and np.max(np.abs(values)) < MAX_EXACT):
+        return None, None, np.asarray(values, np.float64)
+    whole = np.asarray(values).astype(np.int64)
+    deltas = np.diff(whole, prepend=whole[0])
+    if modulus is not None and whole.min() >= 0 and whole.max() < modulus:
+        deltas %= modulus
+    else:
+        modulus = None
+    low, high = deltas.min(), deltas.max()
+    for dtype in INTEGER_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return int(whole[0]), modulus, deltas.astype(dtype)
+
+
+# Function to undo encode_column on a slice of a day's buffer
+def decode_column(buffer, offset, dtype, count, first, modulus=None):
+    size = np.dtype(dtype).itemsize
+    column = buffer[offset:offset + count * size].view(dtype)
+    if first is None:
+        return column
+    column = np.cumsum(column, dtype=np.int64) + first
+    return column % modulus if modulus else column
+
+
+# Function to write one day of samples to the archive
+def export_day(connection, day, directory=ARCHIVE_DIR):
+    """Returns (series, samples) written for `day` (a date)."""
+    rows = connection.execute(text(DAY_SAMPLES_SQL).execution_options(stream_results=True), {
+        "day": day, "next_day": day + timedelta(days=1),
+    })
+    series = []
+    samples = 0
+    data = bytearray()
+
+    def append(column):
+        data.extend(b"\0" * (-len(data) % ALIGNMENT))
+        offset = len(data)
+        data.extend(column.tobytes())
+        return offset
+
+    for (ip_port, metric_name, oid, if_index, value_type), points in groupby(rows, key=lambda r: r[:5]):
+        ms = []
+        values = []
+        for row in points:
+            ms.append(row.ms)
+            values.append(row.value)
+        t0, _, t = encode_column(np.array(ms, np.int64))
+        # Counter32 deltas are kept modulo 2^32, so wraps do not widen the column
+        v0, modulus, v = encode_column(np.array(values, np.float64),
+                                       COUNTER32_MODULUS if value_type == "Counter32" else None)
+        series.append({
+            "ip_port": ip_port,
+            "metric_name": metric_name,
+            "oid": oid,
+            "if_index": if_index,
+            "value_type": value_type,
+            "count": len(ms),
+            "t0": t0,
+            "t_type": t.dtype.name,
+            "t_offset": append(t),
+            "v0": v0,
+            "v_modulus": modulus,
+            "v_type": v.dtype.name,
+            "v_offset": append(v),
+        })
+        samples += len(ms)
+
+    # Data first, index last: the index is what marks the day as archived
+    os.makedirs(directory, exist_ok=True)
+    with open(day_file(directory, day, "bin.tmp"), "wb") as f:
+        f.write(data)
+    os.replace(day_file(directory, day, "bin.tmp"), day_file(directory, day, "bin"))
+    with open(day_file(directory, day, "json.tmp"), "w") as f:
+        json.dump({"day": day.isoformat(), "series": series}, f)
+    os.replace(day_file(directory, day, "json.tmp"), day_file(directory, day, "json"))
+    return len(series), samples
+
+
+# Function to export every closed day that is not archived yet
+def run_export(engine, directory=ARCHIVE_DIR, after=ARCHIVE_AFTER, drop=False):
+    """
+    Exports the days after the last archived one (or from the first sample
+    on) that ended more than `after` ago, oldest first. With `drop`, each
+    day's partition is dropped once its files are written. Returns the
+    days exported.
+    """
+    archive = ColdArchive(directory)
+    with engine.connect() as connection:
+        today = connection.execute(text("SELECT (now() AT TIME ZONE 'UTC')::date")).scalar()
+        last = archive.last_day()
+        if last is None:
+            day = connection.execute(text("SELECT MIN(timestamp)::date FROM snmp_samples")).scalar()
+            if day is None:
+                return []
+        else:
+            day = last + timedelta(days=1)
+
+    exported = []
+    while day < today - after:
+        with engine.connect() as connection:
+            series, samples = export_day(connection, day, directory)
+        print(f"Archived {day}: {samples} sample(s) in {series} series")
+        if drop:
+            with engine.begin() as connection:
+                connection.execute(text(f"DROP TABLE IF EXISTS {PARTITION_PREFIX}{day:%Y%m%d}"))
+            print(f"Dropped partition '{PARTITION_PREFIX}{day:%Y%m%d}'.")
+        exported.append(day)
+        day += timedelta(days=1)
+    return exported
+
+
+# Function to turn one counter series into per-second rates
+def series_rates(t, v, value_type, boots):
+    """
+    t in epoch seconds, v as read. Returns (t, rate) of every interval
+    with a known increase, with the wrap and restart rules of rates.py.
+    `boots` is (uptime sample times, implied boot times) of the device;
+    an interval is dropped when the last uptime sample inside it implies
+    a boot after the interval started.
+    """
+    dt = np.diff(t)
+    dv = np.diff(v)
+    modulus = COUNTER_MODULUS.get(value_type)
+    known = dt > 0
+    if modulus is None:
+        known &= dv >= 0
+    else:
+        dv = np.where(dv < 0, dv + modulus, dv)
+    uptime_t, boot_t = boots
+    if len(uptime_t):
+        low = np.searchsorted(uptime_t, t[:-1], side="right")
+        high = np.searchsorted(uptime_t, t[1:], side="right")
+        restarted = (high > low) & (boot_t[np.maximum(high - 1, 0)] > t[:-1])
+        known &= ~restarted
+    return t[1:][known], dv[known] / dt[known]
+
+
+class ColdArchive:
+    """
+    Read side of the archive. The list of days is rescanned when the
+    directory changes; day indexes are parsed once and kept in an LRU.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.days = []
+        self.scanned = None
+        self.indexes = OrderedDict()
+
+    def _scan(self):
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            self.days = []
+            return
+        with self.lock:
+            if mtime == self.scanned:
+                return
+            names = os.listdir(self.directory)
+            self.days = sorted(
+                datetime.strptime(name[:8], "%Y%m%d").date()
+                for name in names
+                if name.endswith(".json") and name[:8].isdigit()
+            )
+            self.scanned = mtime
+
+    def last_day(self):
+        self._scan()
+        return self.days[-1] if self.days else None
+
+    def end(self):
+        """Start of the first day not in the archive, as a naive datetime, or None if it is empty."""
+        last = self.last_day()
+        return None if last is None else datetime.combine(last + timedelta(days=1), time())
+
+    def _index(self, day):
+        with self.lock:
+            index = self.indexes.get(day)
+            if index is not None:
+                self.indexes.move_to_end(day)
+                return index
+        with open(day_file(self.directory, day, "json")) as f:
+            index = json.load(f)
+        with self.lock:
+            self.indexes[day] = index
+            while len(self.indexes) > INDEX_CACHE_DAYS:
+                self.indexes.popitem(last=False)
+        return index
+
+    def read(self, metric_names, start, end):
+        """
+        Yields (entry, t, v) for every archived series of `metric_names`
+        per day in [start, end), t in epoch seconds and v as float64.
+        """
+        self._scan()
+        first, last = start.date(), end.date()
+        for day in self.days:
+            if day < first or day > last:
+                continue
+            index = self._index(day)
+            entries = [e for e in index["series"] if e["metric_name"] in metric_names and e["count"]]
+            if not entries:
+                continue
+            buffer = np.memmap(day_file(self.directory, day, "bin"), dtype=np.uint8, mode="r")
+            for e in entries:
+                t = decode_column(buffer, e["t_offset"], e["t_type"], e["count"], e["t0"]) / 1000
+                v = decode_column(buffer, e["v_offset"], e["v_type"], e["count"], e["v0"],
+                                  e["v_modulus"]).astype(np.float64)
+                yield e, t, v
+
+    # Function to compute summed rates like rates.fetch_aggregate_rates, from the archive
+    def rate_rows(self, metric_names, start, end, step):
+        """
+        Returns rows of (metric_name, t, rate) over [start, end) ordered by
+        metric and time: each series is averaged over `step` second buckets
+        and the bucket averages are summed over all series of the metric.
+        """
+        read_start, start_t, end_t = to_epoch(start - LOOKBACK), to_epoch(start), to_epoch(end)
+        series = defaultdict(lambda: ([], []))
+        uptimes = defaultdict(lambda: ([], []))
+        types = {}
+        for e, t, v in self.read(set(metric_names) | {UPTIME_METRIC}, start - LOOKBACK, end):
+            if e["metric_name"] == UPTIME_METRIC:
+                ts, boots = uptimes[e["ip_port"]]
+                ts.append(t)
+                boots.append(t - v / 100)
+            if e["metric_name"] in metric_names:
+                key = (e["metric_name"], e["ip_port"], e["oid"])
+                series[key][0].append(t)
+                series[key][1].append(v)
+                types[key] = e["value_type"]
+        boots = {ip_port: (np.concatenate(ts), np.concatenate(bs)) for ip_port, (ts, bs) in uptimes.items()}
+        no_boots = (np.zeros(0), np.zeros(0))
+
+        buckets = defaultdict(lambda: ([], []))
+        for key, (ts, vs) in series.items():
+            t = np.concatenate(ts)
+            v = np.concatenate(vs)
+            window = (t >= read_start) & (t < end_t)
+            t, rate = series_rates(t[window], v[window], types[key], boots.get(key[1], no_boots))
+            t, rate = t[t >= start_t], rate[t >= start_t]
+            if not len(t):
+                continue
+            # Average of the series per bucket
+            bucket, inverse = np.unique(np.floor(t / step).astype(np.int64) * step, return_inverse=True)
+            buckets[key[0]][0].append(bucket)
+            buckets[key[0]][1].append(np.bincount(inverse, rate) / np.bincount(inverse))
+
+        rows = []
+        for metric_name in sorted(buckets):
+            bs, averages = buckets[metric_name]
+            bucket, inverse = np.unique(np.concatenate(bs), return_inverse=True)
+            total = np.bincount(inverse, np.concatenate(averages))
+            rows.extend(zip([metric_name] * len(bucket), bucket.tolist(), total.tolist()))
+        return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export closed days of samples to the cold archive.")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="archive directory")
+    parser.add_argument("--after-days", type=int, default=ARCHIVE_AFTER.days,
+                        help="export days that ended more than this many days ago")
+    parser.add_argument("--drop", action="store_true",
+                        help="drop each day's partition once it is archived")
+    args = parser.parse_args()
+
+    from app import app, db
+
+    with app.app_context():
+        try:
+            run_export(db.engine, args.dir, timedelta(days=args.after_days), args.drop)
+        except Exception as e:
+            print(f"Error archiving samples: {e}")
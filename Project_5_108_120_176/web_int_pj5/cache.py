@@ -0,0 +1,95 @@
+# Response cache for the dashboard APIs.
+#
+# API responses only change when the collector writes a new round, so they
+# are cached per request (path + query string) together with the ingest
+# watermark they were built from. A request whose watermark still matches
+# is answered from memory, and clients that already hold that version get
+# a 304 through the ETag without the response being rebuilt at all.
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+# Cached responses kept at most, by count and by total body size
+MAX_ENTRIES = 256
+MAX_BYTES = 64 * 1024 * 1024
+
+
+class ResponseCache:
+    """Bounded LRU of response bodies, each tagged with its watermark."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, watermark):
+        """Returns (body, mimetype) cached for `key` at `watermark`, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != watermark:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, watermark, body, mimetype):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (watermark, body, mimetype)
+            self.size += len(body)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def cached(self, get_watermark):
+        """
+        Decorator for a Flask view. `get_watermark` returns the time of the
+        newest ingested sample (or None while there is none); a new value
+        invalidates every cached response.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                watermark = get_watermark()
+                if watermark is None:
+                    return view(*args, **kwargs)
+
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                etag = hashlib.sha1(repr((key, watermark)).encode()).hexdigest()
+
+                # The client already has this version; nothing to build or send
+                if request.if_none_match.contains(etag):
+                    response = Response(status=304)
+                    response.set_etag(etag)
+                    response.headers["Cache-Control"] = "no-cache"
+                    return response
+
+                cached = self.get(key, watermark)
+                if cached is not None:
+                    response = Response(cached[0], mimetype=cached[1])
+                else:
+                    response = view(*args, **kwargs)
+                    # Streamed bodies are not cached; reading them here would buffer them
+                    if (not isinstance(response, Response) or response.status_code != 200
+                            or response.is_streamed):
+                        return response
+                    self.put(key, watermark, response.get_data(), response.mimetype)
+
+                response.set_etag(etag)
+                # Let browsers keep the body but revalidate it on every request
+                response.headers["Cache-Control"] = "no-cache"
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
@@ -0,0 +1,52 @@
+DEFAULT_MAX_POINTS = 1000
+
+# Below this LTTB has nothing to choose between (first and last are always kept)
+MIN_POINTS = 3
+
+
+def lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets. Returns the indexes of at most
+    `threshold` points of (xs, ys) that best keep the shape of the line.
+    xs must be increasing.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < MIN_POINTS:
+        return list(range(n))
+
+    # First and last points are always kept; the rest is split into buckets
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third corner of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        # Pick the point of this bucket that makes the largest triangle
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax = xs[a]
+        ay = ys[a]
+        max_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                best = j
+        selected.append(best)
+        a = best
+
+    selected.append(n - 1)
+    return selected
+
+
+# Function to pick which points of a t/v series to keep
+def downsample_indexes(ts, vs, max_points):
+    if not max_points or len(ts) <= max_points:
+        return range(len(ts))
+    return lttb(ts, vs, max_points)
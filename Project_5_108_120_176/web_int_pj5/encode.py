@@ -0,0 +1,91 @@
+# Streaming encodings of (metric_name, t, value) rows for long windows.
+#
+# Rows are consumed as the database cursor produces them and written out
+# in fixed-size chunks, so memory use and time to first byte do not grow
+# with the window.
+#
+# format=columnar: newline-delimited JSON, one object per chunk
+#     {"series": "in", "t": [epoch, ...], "v": [value, ...]}
+#   followed by a last line {"stats": {"in": {...}, "out": {...}}}.
+# format=binary: repeated frames of
+#     uint8 series index, uint32 point count n,
+#     n x int64 epoch seconds, n x float64 values
+#   followed by a last frame of
+#     uint8 255, uint32 series count n,
+#     n x 4 float64 (current, average, max, min), one row per series
+#   all little-endian; series indexes follow the order the API documents.
+import json
+import struct
+import sys
+from array import array
+
+from queries import Stats
+
+# Points per chunk
+CHUNK_ROWS = 5000
+
+FRAME_HEADER = struct.Struct("<BI")
+
+# Series index of the closing stats frame, and the order of its columns
+STATS_INDEX = 255
+STATS_FIELDS = ("current", "average", "max", "min")
+
+FORMATS = {
+    "columnar": "application/x-ndjson",
+    "binary": "application/octet-stream",
+}
+
+
+# Function to group ordered rows into (metric_name, t array, v array) chunks
+def iter_chunks(rows, stats, scale=1, chunk_rows=CHUNK_ROWS):
+    """
+    Rows must be ordered by metric. Values are multiplied by `scale` and
+    added to stats[metric_name] on the way through.
+    """
+    current = None
+    ts = array("q")
+    vs = array("d")
+    for metric_name, t, value in rows:
+        if metric_name != current or len(ts) >= chunk_rows:
+            if ts:
+                yield current, ts, vs
+            current = metric_name
+            ts = array("q")
+            vs = array("d")
+        value *= scale
+        ts.append(t)
+        vs.append(value)
+        stats[metric_name].add(value)
+    if ts:
+        yield current, ts, vs
+
+
+def encode_columnar(rows, labels, scale=1):
+    """`labels` maps each metric_name to the series name used in the output."""
+    stats = {metric_name: Stats() for metric_name in labels}
+    for metric_name, ts, vs in iter_chunks(rows, stats, scale):
+        yield json.dumps({"series": labels[metric_name], "t": ts.tolist(), "v": vs.tolist()}) + "\n"
+    yield json.dumps({"stats": {labels[name]: s.as_dict() for name, s in stats.items()}}) + "\n"
+
+
+def encode_binary(rows, labels, scale=1):
+    """Series index n is the n-th key of `labels`."""
+    indexes = {metric_name: i for i, metric_name in enumerate(labels)}
+    stats = {metric_name: Stats() for metric_name in labels}
+    for metric_name, ts, vs in iter_chunks(rows, stats, scale):
+        if sys.byteorder == "big":
+            ts.byteswap()
+            vs.byteswap()
+        yield FRAME_HEADER.pack(indexes[metric_name], len(ts)) + ts.tobytes() + vs.tobytes()
+    summary = array("d", (
+        stats[metric_name].as_dict()[field] for metric_name in labels for field in STATS_FIELDS
+    ))
+    if sys.byteorder == "big":
+        summary.byteswap()
+    yield FRAME_HEADER.pack(STATS_INDEX, len(labels)) + summary.tobytes()
+
+
+ENCODERS = {
+    "columnar": encode_columnar,
+    "binary": encode_binary,
+}
@@ -0,0 +1,25 @@
+# Gunicorn settings for wsgi.py. Any of them can be overridden on the
+# command line, e.g. `gunicorn -c gunicorn.conf.py -w 2 wsgi:application`.
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+# Worker processes; each one keeps its own response cache, hot window and
+# database pools, so more workers cost memory and connections
+workers = int(os.environ.get("WEB_WORKERS", min(4, multiprocessing.cpu_count() * 2 + 1)))
+
+# Threaded workers so /api/stream (SSE) clients, which hold a thread each,
+# do not block the other requests. At most STREAM_SLOTS (8) of each worker's
+# threads serve streams; raise WEB_THREADS with it for more open dashboards
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 16))
+
+# The hot window and device summaries run background threads, which would
+# not survive the fork if the app were loaded in the master
+preload_app = False
+
+# SSE responses stay open; workers only count as stuck with no request activity
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
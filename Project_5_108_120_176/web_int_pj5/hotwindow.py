@@ -0,0 +1,325 @@
+# In-memory copy of the most recent samples, for the hour view.
+#
+# A background thread loads the last HOT_WINDOW of the dashboard metrics at
+# start-up, then LISTENs on the collector's snmp_ingest channel and appends
+# every new batch. Each series lives in a fixed-size ring of two float
+# arrays, so hour views and "current" stats are answered without touching
+# PostgreSQL. Until the first load has finished, or for windows the rings
+# do not cover, callers fall back to the database.
+import select
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+
+from queries import collect_series
+from rates import DEFAULT_STEP, LOOKBACK, UPTIME_METRIC, counter_delta
+
+# How much history is kept; the hour view plus the rate look-back
+HOT_WINDOW = timedelta(hours=1) + LOOKBACK + timedelta(minutes=5)
+
+# Samples kept per series: HOT_WINDOW at one sample every 10 seconds
+RING_CAPACITY = int(HOT_WINDOW.total_seconds() // 10)
+
+HOT_METRICS = ["Bandwidth In", "Bandwidth Out", UPTIME_METRIC]
+
+INGEST_CHANNEL = "snmp_ingest"
+
+# Seconds to wait for a notification before checking for new rows anyway,
+# so a collector that does not NOTIFY is still picked up
+POLL_INTERVAL = 5
+
+# The collector's DEFAULT_POLL_BUDGET (poller_pj5.py) and FLUSH_INTERVAL
+# (writer_pj5.py): samples are stamped when they are read, so a batch can
+# commit up to a whole poll plus a flush interval after its oldest sample
+COLLECTOR_POLL_BUDGET = 30
+COLLECTOR_FLUSH_INTERVAL = 5
+
+# Longest a sample may take from being read to being committed, with room
+# for a slow insert. Batches held up longer, while the database is down or
+# the writer backs off, are spooled and come back as replays (see _reread)
+MAX_INGEST_DELAY = timedelta(seconds=2 * (COLLECTOR_POLL_BUDGET + COLLECTOR_FLUSH_INTERVAL))
+
+# Rows are re-read this far behind the newest one seen, in case a batch
+# committed late with an older timestamp; duplicates are dropped per series
+TAIL_OVERLAP = MAX_INGEST_DELAY
+
+# Seconds to wait before reconnecting after a database error
+RECONNECT_DELAY = 10
+
+SAMPLES_SQL = """
+    SELECT s.device_id, s.metric_id, m.metric_name, m.value_type, s.timestamp, s.value
+    FROM snmp_samples s
+    JOIN snmp_metrics m ON m.metric_id = s.metric_id
+    WHERE m.metric_name = ANY(%s) AND s.timestamp > {start}
+    ORDER BY s.timestamp
+"""
+
+
+def to_epoch(timestamp):
+    """Epoch seconds of a naive database timestamp (read as UTC, like EXTRACT(EPOCH))."""
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+class RingBuffer:
+    """Last `capacity` (timestamp, value) pairs of one series, oldest first."""
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.ts = array("d", [0.0]) * capacity
+        self.values = array("d", [0.0]) * capacity
+        self.start = 0
+        self.size = 0
+        # Newest timestamp that has been overwritten; the ring is complete after it
+        self.dropped_until = None
+
+    def append(self, ts, value):
+        if self.size and ts <= self.last_ts():
+            return
+        if self.size < self.capacity:
+            i = (self.start + self.size) % self.capacity
+            self.size += 1
+        else:
+            i = self.start
+            self.dropped_until = self.ts[i]
+            self.start = (self.start + 1) % self.capacity
+        self.ts[i] = ts
+        self.values[i] = value
+
+    def last_ts(self):
+        return self.ts[(self.start + self.size - 1) % self.capacity]
+
+    def truncate(self, ts):
+        """Drops the pairs newer than `ts`, so they can be appended again."""
+        while self.size and self.last_ts() > ts:
+            self.size -= 1
+
+    def items(self, low, high):
+        """(timestamp, value) pairs with low <= timestamp <= high."""
+        for n in range(self.size):
+            i = (self.start + n) % self.capacity
+            ts = self.ts[i]
+            if ts > high:
+                return
+            if ts >= low:
+                yield ts, self.values[i]
+
+
+class HotWindow:
+    """Ring buffers of the HOT_METRICS series, kept current by a background thread."""
+
+    def __init__(self, window=HOT_WINDOW, capacity=RING_CAPACITY):
+        self.window = window
+        self.capacity = capacity
+        # (device_id, metric_id) -> RingBuffer, and -> (metric_name, value_type)
+        self.rings = {}
+        self.meta = {}
+        # device_id -> key of its uptime series
+        self.uptime = {}
+        self.latest = None
+        # Epoch from which the rings hold every sample; None until loaded
+        self.loaded_from = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, dsn):
+        """Starts the loader thread once; later calls do nothing."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, args=(dsn,), name="hot-window", daemon=True)
+        self.thread.start()
+
+    def covers(self, start):
+        """True when every sample since `start` (a datetime) is in memory."""
+        with self.lock:
+            if self.loaded_from is None or to_epoch(start) < self.loaded_from:
+                return False
+            low = to_epoch(start)
+            return all(r.dropped_until is None or r.dropped_until < low for r in self.rings.values())
+
+    def latest_time(self):
+        """Newest sample time in memory, or None before the first load."""
+        with self.lock:
+            return self.latest if self.loaded_from is not None else None
+
+    def value_series(self, metric_names, start):
+        """Same result as queries.fetch_value_series, from memory."""
+        low = to_epoch(start)
+        rows = []
+        with self.lock:
+            for key, ring in self.rings.items():
+                metric_name = self.meta[key][0]
+                if metric_name in metric_names:
+                    rows.extend((ts, metric_name, value) for ts, value in ring.items(low, float("inf")))
+        rows.sort(key=lambda row: row[0])
+        return collect_series(((name, int(ts), value) for ts, name, value in rows), metric_names)
+
+    def rate_series(self, metric_names, start, end, step=DEFAULT_STEP, scale=1):
+        """Same result as queries.fetch_rate_series on raw samples, from memory."""
+        low = to_epoch(start)
+        high = to_epoch(end)
+        read_low = low - LOOKBACK.total_seconds()
+        # Samples are copied under the lock and the rates worked out after
+        # releasing it, so a long window does not hold up new batches
+        with self.lock:
+            series = [
+                (key[0], self.meta[key], list(ring.items(read_low, high)))
+                for key, ring in self.rings.items()
+                if self.meta[key][0] in metric_names
+            ]
+            boots = {device_id: self._boots(device_id, read_low, high) for device_id, _, _ in series}
+
+        totals = {name: defaultdict(float) for name in metric_names}
+        for device_id, (metric_name, value_type), items in series:
+            uptime_ts, latest_boot = boots[device_id]
+            buckets = defaultdict(list)
+            for (prev_ts, prev_value), (ts, value) in zip(items, items[1:]):
+                if ts < low:
+                    continue
+                # A boot after prev_ts implied by an uptime sample up to ts
+                # means the agent restarted during the interval
+                i = bisect_right(uptime_ts, ts)
+                if i and latest_boot[i - 1] > prev_ts:
+                    continue
+                delta = counter_delta(value, prev_value, value_type)
+                if delta is not None:
+                    buckets[int(ts // step) * step].append(delta / (ts - prev_ts))
+            for bucket, rates in buckets.items():
+                totals[metric_name][bucket] += sum(rates) / len(rates)
+
+        rows = (
+            (name, t, rate)
+            for name in metric_names
+            for t, rate in sorted(totals[name].items())
+        )
+        return collect_series(rows, metric_names, scale)
+
+    def _boots(self, device_id, low, high):
+        """
+        Times of the uptime samples of a device in [low, high], and the
+        latest boot time implied by any of them up to each, for bisecting.
+        """
+        key = self.uptime.get(device_id)
+        times, boots = [], []
+        if key is None:
+            return times, boots
+        for ts, value in self.rings[key].items(low, high):
+            times.append(ts)
+            boots.append(max(ts - value / 100, boots[-1]) if boots else ts - value / 100)
+        return times, boots
+
+    def _add(self, rows):
+        with self.lock:
+            self._append(rows)
+
+    def _append(self, rows):
+        for device_id, metric_id, metric_name, value_type, timestamp, value in rows:
+            key = (device_id, metric_id)
+            ring = self.rings.get(key)
+            if ring is None:
+                ring = self.rings[key] = RingBuffer(self.capacity)
+                self.meta[key] = (metric_name, value_type)
+                if metric_name == UPTIME_METRIC:
+                    self.uptime[device_id] = key
+            ring.append(to_epoch(timestamp), value)
+            if self.latest is None or timestamp > self.latest:
+                self.latest = timestamp
+
+    def _load(self, connection):
+        """Cold start: reads the whole window, then marks the rings complete."""
+        cursor = connection.cursor()
+        cursor.execute("SELECT now() AT TIME ZONE 'UTC'")
+        start = cursor.fetchone()[0] - self.window
+        cursor.execute(SAMPLES_SQL.format(start="%s"), (HOT_METRICS, start))
+        self._add(cursor.fetchall())
+        cursor.close()
+        with self.lock:
+            self.loaded_from = to_epoch(start)
+
+    def _tail(self, connection):
+        """Reads the rows added since the newest one already in memory."""
+        with self.lock:
+            since = self.latest
+        cursor = connection.cursor()
+        if since is None:
+            cursor.execute(SAMPLES_SQL.format(start="now() AT TIME ZONE 'UTC' - %s"), (HOT_METRICS, self.window))
+        else:
+            cursor.execute(SAMPLES_SQL.format(start="%s"), (HOT_METRICS, since - TAIL_OVERLAP))
+        self._add(cursor.fetchall())
+        cursor.close()
+        self._evict()
+
+    def _evict(self):
+        """
+        Drops the series with nothing newer than the window, e.g. of devices
+        or interfaces that are no longer polled. The rings then only cover
+        the time after their last sample.
+        """
+        with self.lock:
+            if self.latest is None or self.loaded_from is None:
+                return
+            oldest = to_epoch(self.latest - self.window)
+            for key in [key for key, ring in self.rings.items() if not ring.size or ring.last_ts() < oldest]:
+                ring = self.rings.pop(key)
+                del self.meta[key]
+                if self.uptime.get(key[0]) == key:
+                    del self.uptime[key[0]]
+                if ring.size:
+                    self.loaded_from = max(self.loaded_from, ring.last_ts() + 1)
+
+    def _reread(self, connection, since):
+        """
+        Replaces the samples from `since` on with the database's, for
+        batches replayed from a collector's spool: they are older than
+        what _tail() re-reads and than the newest sample of their series.
+        """
+        with self.lock:
+            latest = self.latest
+        if latest is None:
+            return
+        start = max(since - timedelta(microseconds=1), latest - self.window)
+        cursor = connection.cursor()
+        cursor.execute(SAMPLES_SQL.format(start="%s"), (HOT_METRICS, start))
+        rows = cursor.fetchall()
+        cursor.close()
+        with self.lock:
+            for key in {(row[0], row[1]) for row in rows}:
+                if key in self.rings:
+                    self.rings[key].truncate(to_epoch(start))
+            self._append(rows)
+
+    def _run(self, dsn):
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(dsn)
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {INGEST_CHANNEL};")
+                if self.loaded_from is None:
+                    self._load(connection)
+                replayed = None
+                while True:
+                    # Rows committed while disconnected or between notifications
+                    self._tail(connection)
+                    if replayed is not None:
+                        self._reread(connection, replayed)
+                        replayed = None
+                    if select.select([connection], [], [], POLL_INTERVAL) != ([], [], []):
+                        connection.poll()
+                        # Replayed batches send the time of their oldest sample
+                        replayed = min(
+                            (datetime.fromisoformat(n.payload) for n in connection.notifies if n.payload),
+                            default=None
+                        )
+                        connection.notifies.clear()
+            except Exception as e:
+                print(f"Hot window error: {e}")
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                if connection is not None:
+                    connection.close()
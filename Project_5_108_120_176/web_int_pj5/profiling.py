@@ -0,0 +1,210 @@
+# Opt-in request profiling for the dashboard APIs.
+#
+# With PROFILING enabled every request records where its time went: SQL
+# time, query count and rows (from SQLAlchemy cursor events), the named
+# phases the views mark with `phase()`, and the bytes sent. The breakdown
+# goes back to the browser as a Server-Timing header and into per-endpoint
+# histograms that /metrics exposes. Queries slower than SLOW_QUERY_SECONDS
+# are logged together with their EXPLAIN plan.
+#
+# When profiling is off none of the hooks are installed and phase() does
+# nothing.
+import contextlib
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Queries slower than this are logged with their plan
+SLOW_QUERY_SECONDS = 0.5
+# The same statement is EXPLAINed at most once per this many seconds
+EXPLAIN_INTERVAL = 300
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RequestProfile:
+    """Timings of one request; lives on flask.g while the request runs."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+
+    def server_timing(self):
+        entries = [f"db;dur={self.db_seconds * 1000:.1f};desc=\"{self.queries} queries, {self.rows} rows\""]
+        entries.extend(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items())
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        # (endpoint, phase) -> Histogram of seconds; phase "total" and "db" included
+        self.latency = {}
+        self.sizes = {}
+        self.rows = {}
+        self.slow_queries = 0
+        self.explained = {}
+
+    def init_app(self, app):
+        """Installs the hooks if app.config['PROFILING'] is set."""
+        self.enabled = bool(app.config.get('PROFILING'))
+        if not self.enabled:
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        event.listen(Engine, "before_cursor_execute", self._before_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_execute)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Adds the time spent in the block to phase `name` of this request."""
+        profile = g.get('profile') if self.enabled else None
+        if profile is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            profile.phases[name] = profile.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def _start(self):
+        g.profile = RequestProfile()
+
+    def _finish(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        endpoint = request.endpoint or "unknown"
+        response.headers["Server-Timing"] = profile.server_timing()
+
+        if response.is_streamed:
+            # Count the bytes as they go out and record once the stream ends
+            sent = [0]
+            body = response.response
+
+            def counted():
+                for chunk in body:
+                    sent[0] += len(chunk)
+                    yield chunk
+            response.response = counted()
+            response.call_on_close(lambda: self._record(endpoint, profile, sent[0]))
+        else:
+            self._record(endpoint, profile, response.calculate_content_length() or 0)
+        return response
+
+    def _record(self, endpoint, profile, size):
+        total = time.perf_counter() - profile.started
+        with self.lock:
+            for phase, seconds in [("total", total), ("db", profile.db_seconds)] + list(profile.phases.items()):
+                key = (endpoint, phase)
+                if key not in self.latency:
+                    self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.latency[key].observe(seconds)
+            if endpoint not in self.sizes:
+                self.sizes[endpoint] = Histogram(SIZE_BUCKETS)
+                self.rows[endpoint] = 0
+            self.sizes[endpoint].observe(size)
+            self.rows[endpoint] += profile.rows
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_started"].pop()
+        profile = g.get('profile') if self._in_request() else None
+        if profile is not None:
+            profile.db_seconds += seconds
+            profile.queries += 1
+            # Server-side cursors report -1 until they are read
+            profile.rows += max(0, cursor.rowcount)
+        if seconds >= SLOW_QUERY_SECONDS:
+            self._slow_query(conn, statement, parameters, seconds)
+
+    @staticmethod
+    def _in_request():
+        try:
+            return bool(request)
+        except RuntimeError:
+            return False
+
+    def _slow_query(self, conn, statement, parameters, seconds):
+        now = time.monotonic()
+        with self.lock:
+            self.slow_queries += 1
+            explain = (statement.split(None, 1)[0].upper() in ("SELECT", "WITH")
+                       and now - self.explained.get(statement, -EXPLAIN_INTERVAL) >= EXPLAIN_INTERVAL)
+            if explain:
+                self.explained[statement] = now
+        print(f"Slow query ({seconds * 1000:.0f} ms): {' '.join(statement.split())} {parameters}")
+        if not explain:
+            return
+        try:
+            # A separate cursor on the same connection, so no pool slot is needed
+            cursor = conn.connection.cursor()
+            cursor.execute("EXPLAIN " + statement, parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            cursor.close()
+            print(f"Plan:\n{plan}")
+        except Exception as e:
+            print(f"Error explaining slow query: {e}")
+
+    def render_prometheus(self):
+        with self.lock:
+            lines = [
+                "# HELP dashboard_request_phase_seconds Time per request spent in each phase.",
+                "# TYPE dashboard_request_phase_seconds histogram",
+            ]
+            for (endpoint, phase), histogram in sorted(self.latency.items()):
+                lines.extend(histogram.render("dashboard_request_phase_seconds",
+                                              f'endpoint="{endpoint}",phase="{phase}"'))
+            lines.append("# HELP dashboard_response_bytes Bytes sent per response.")
+            lines.append("# TYPE dashboard_response_bytes histogram")
+            for endpoint, histogram in sorted(self.sizes.items()):
+                lines.extend(histogram.render("dashboard_response_bytes", f'endpoint="{endpoint}"'))
+            lines.append("# HELP dashboard_rows_fetched_total Rows returned by SQL queries.")
+            lines.append("# TYPE dashboard_rows_fetched_total counter")
+            for endpoint, rows in sorted(self.rows.items()):
+                lines.append(f'dashboard_rows_fetched_total{{endpoint="{endpoint}"}} {rows}')
+            lines.append(f"# HELP dashboard_slow_queries_total Queries slower than {SLOW_QUERY_SECONDS}s.")
+            lines.append("# TYPE dashboard_slow_queries_total counter")
+            lines.append(f"dashboard_slow_queries_total {self.slow_queries}")
+            return "\n".join(lines) + "\n"
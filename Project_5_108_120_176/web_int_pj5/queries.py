@@ -0,0 +1,309 @@
+# Data access for the dashboard APIs.
+#
+# Every direction a dashboard shows comes back from a single query as
+# columnar arrays (epoch seconds in `t`, numbers in `v`), and the summary
+# stats are accumulated while the rows are read, so a request costs one
+# round-trip and no per-row objects beyond the two lists.
+from datetime import datetime, timedelta
+from itertools import chain
+
+from sqlalchemy import text
+
+from rates import (BOOTS_CTE, DEFAULT_STEP, DELTA_EXPRESSION, LOOKBACK, UPTIME_METRIC, fetch_aggregate_rates,
+                   fetch_series_rates)
+from rollup import RESOLUTIONS, fetch_rollup_rates, rollup_coverage
+
+LATEST_SAMPLE_SQL = "SELECT MAX(last_sample) FROM snmp_devices"
+
+# Fallback for databases written by a collector that does not track last_sample
+LATEST_SAMPLE_SCAN_SQL = "SELECT MAX(timestamp) FROM snmp_samples"
+
+# Daily partitions are named snmp_samples_pYYYYMMDD, so the smallest name is the oldest day
+OLDEST_PARTITION_SQL = """
+    SELECT MIN(c.relname)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'snmp_samples'::regclass AND c.relname ~ '^snmp_samples_p[0-9]{8}$'
+"""
+
+VALUES_SQL = """
+    SELECT m.metric_name, FLOOR(EXTRACT(EPOCH FROM s.timestamp))::bigint AS t, s.value
+    FROM snmp_samples s
+    JOIN snmp_metrics m ON m.metric_id = s.metric_id
+    WHERE m.metric_name = ANY(:metric_names) AND s.timestamp >= :start
+    ORDER BY m.metric_name, s.timestamp
+"""
+
+# Bucket aggregates accepted by fetch_query_series, applied to the
+# points of one series within a step
+AGGREGATES = {
+    "avg": "AVG(p.value)",
+    "min": "MIN(p.value)",
+    "max": "MAX(p.value)",
+    "sum": "SUM(p.value)",
+    "count": "COUNT(p.value)",
+    "last": "(ARRAY_AGG(p.value ORDER BY p.timestamp DESC))[1]",
+}
+
+# How series are combined: the columns kept, the rest are summed over
+GROUPINGS = {
+    "series": ("ip_port", "if_index"),
+    "device": ("ip_port", "NULL::integer"),
+    "metric": ("NULL::varchar", "NULL::integer"),
+}
+
+# Any metrics of any devices and interfaces over [:start, :end) in one
+# statement. Counter metrics become per-second rates (with the wrap and
+# restart rules of rates.py) when :rates is set; the others are read as
+# they are. Points are aggregated per series into :step second buckets.
+QUERY_SQL = f"""
+    WITH {BOOTS_CTE},
+    series AS (
+        SELECT metric_id, metric_name, if_index, value_type,
+               :rates AND value_type IN ('Counter32', 'Counter64') AS is_rate
+        FROM snmp_metrics
+        WHERE metric_name = ANY(:metric_names)
+          AND (:any_interface OR if_index = ANY(:if_indexes))
+    ),
+    devices AS (
+        SELECT device_id, ip_port FROM snmp_devices
+        WHERE :any_device OR ip_port = ANY(:ip_ports)
+    ),
+    d AS (
+        SELECT s.device_id, s.metric_id, se.metric_name, se.if_index, se.value_type, se.is_rate,
+               s.timestamp, s.value,
+               LAG(s.value) OVER w AS prev_value,
+               LAG(s.timestamp) OVER w AS prev_ts
+        FROM snmp_samples s
+        JOIN series se ON se.metric_id = s.metric_id
+        WHERE s.device_id IN (SELECT device_id FROM devices)
+          AND s.timestamp >= :read_start AND s.timestamp < :end
+        WINDOW w AS (PARTITION BY s.device_id, s.metric_id ORDER BY s.timestamp)
+    ),
+    p AS (
+        SELECT d.device_id, d.metric_name, d.if_index, d.is_rate, d.timestamp,
+               CASE WHEN NOT d.is_rate THEN d.value
+                    WHEN d.timestamp > d.prev_ts
+                    THEN ({DELTA_EXPRESSION}) / EXTRACT(EPOCH FROM d.timestamp - d.prev_ts)
+               END AS value
+        FROM d
+        WHERE d.timestamp >= :start
+    ),
+    buckets AS (
+        SELECT p.metric_name, p.is_rate, dev.ip_port, p.if_index,
+               FLOOR(EXTRACT(EPOCH FROM p.timestamp) / :step)::bigint * :step AS t,
+               {{aggregate}} AS value
+        FROM p
+        JOIN devices dev ON dev.device_id = p.device_id
+        WHERE p.value IS NOT NULL
+        GROUP BY p.metric_name, p.is_rate, dev.ip_port, p.if_index, t
+    )
+    SELECT metric_name, is_rate, {{device}} AS ip_port, {{interface}} AS if_index, t, SUM(value) AS value
+    FROM buckets
+    GROUP BY metric_name, is_rate, 3, 4, t
+    ORDER BY metric_name, 3, 4, t
+"""
+
+
+class Stats:
+    """Running current/average/min/max of a stream of values."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.current = None
+        self.min = None
+        self.max = None
+
+    def add(self, v):
+        # Negative values are kept on the chart but left out of the stats
+        if v >= 0:
+            self.count += 1
+            self.total += v
+            self.current = v
+            if self.min is None or v < self.min:
+                self.min = v
+            if self.max is None or v > self.max:
+                self.max = v
+
+    def as_dict(self):
+        if not self.count:
+            return {"current": 0, "average": 0, "max": 0, "min": 0}
+        return {
+            "current": self.current,
+            "average": self.total / self.count,
+            "max": self.max,
+            "min": self.min
+        }
+
+
+class Series:
+    """One line of a chart as parallel t/v lists, with running stats."""
+
+    def __init__(self):
+        self.t = []
+        self.v = []
+        self.summary = Stats()
+
+    def add(self, t, v):
+        self.t.append(t)
+        self.v.append(v)
+        self.summary.add(v)
+
+    def stats(self):
+        return self.summary.as_dict()
+
+    def rows(self, metric_name):
+        """The points as (metric_name, t, v) rows, like the fetch_* queries return."""
+        return ((metric_name, t, v) for t, v in zip(self.t, self.v))
+
+
+# Function to find the time of the newest sample
+def latest_timestamp(connection):
+    latest = connection.execute(text(LATEST_SAMPLE_SQL)).scalar()
+    if latest is None:
+        latest = connection.execute(text(LATEST_SAMPLE_SCAN_SQL)).scalar()
+    return latest
+
+
+# Function to find where the samples still in the database begin
+def oldest_sample_day(connection):
+    """
+    Start of the oldest daily partition as a naive UTC datetime, or None
+    if snmp_samples has none. Days before it were dropped, by archive.py
+    --drop or by retention, and only the cold archive may still hold them.
+    """
+    name = connection.execute(text(OLDEST_PARTITION_SQL)).scalar()
+    if name is None:
+        return None
+    return datetime.strptime(name[-8:], "%Y%m%d")
+
+
+# Function to split (metric_name, t, value) rows into one Series per metric
+def collect_series(rows, metric_names, scale=1):
+    series = {name: Series() for name in metric_names}
+    for name, t, value in rows:
+        series[name].add(t, value * scale)
+    return series
+
+
+# Function to read raw (metric_name, t, value) rows of some metrics since `start`
+def fetch_value_rows(connection, metric_names, start, stream=False):
+    """
+    With stream=True the rows are read through a server-side cursor while
+    they are iterated instead of being loaded all at once.
+    """
+    result = connection.execute(text(VALUES_SQL).execution_options(stream_results=stream), {
+        "metric_names": list(metric_names), "start": start,
+    })
+    return result if stream else result.all()
+
+
+# Function to read raw values of some metrics since `start`
+def fetch_value_series(connection, metric_names, start):
+    return collect_series(fetch_value_rows(connection, metric_names, start), metric_names)
+
+
+# Function to read summed (metric_name, t, rate) rows of some counter metrics in [start, end]
+def fetch_rate_rows(connection, metric_names, start, end, resolution=None, stream=False, archive=None):
+    """
+    Reads the rollup table `resolution` when given, otherwise computes the
+    rates from raw samples. See fetch_value_rows for `stream`.
+    Parts of the window the rollup does not hold in full (not rolled up
+    yet, or expired) are computed from raw samples in buckets of the same
+    width.
+    The part of the window before the end of `archive` (an
+    archive.ColdArchive) is read from its files, in buckets of the same
+    width; the rows of each metric then continue with the database's.
+    """
+    boundary = archive.end() if archive is not None else None
+    if boundary is not None and start < boundary:
+        step = dict(RESOLUTIONS)[resolution] if resolution else DEFAULT_STEP
+        cold = archive.rate_rows(metric_names, start, min(end, boundary), step)
+        if end <= boundary:
+            return cold
+        return chain(cold, fetch_rate_rows(connection, metric_names, boundary, end, resolution, stream))
+    if resolution:
+        return fetch_covered_rates(connection, resolution, metric_names, start, end, stream)
+    return fetch_aggregate_rates(connection, metric_names, start, end, stream=stream)
+
+
+# Function to read rollup rates, with raw rates where the rollup has gaps
+def fetch_covered_rates(connection, resolution, metric_names, start, end, stream=False):
+    """
+    Rows of each metric run in time order across the parts, as with the
+    archive in fetch_rate_rows.
+    """
+    width = dict(RESOLUTIONS)[resolution]
+    coverage = rollup_coverage(connection, resolution)
+    if coverage is None:
+        return fetch_aggregate_rates(connection, metric_names, start, end, width, stream)
+    first, covered_end = coverage
+    parts = []
+    if start < first:
+        # Raw bounds are inclusive; stop just before the first rolled-up bucket
+        parts.append(fetch_aggregate_rates(connection, metric_names, start,
+                                           min(end, first - timedelta(microseconds=1)), width, stream))
+    last_bucket = covered_end - timedelta(seconds=width)
+    if max(start, first) <= min(end, last_bucket):
+        parts.append(fetch_rollup_rates(connection, resolution, metric_names, max(start, first),
+                                        min(end, last_bucket), stream=stream))
+    if end >= covered_end:
+        parts.append(fetch_aggregate_rates(connection, metric_names, max(start, covered_end), end, width, stream))
+    return chain(*parts)
+
+
+# Function to read summed rates of some counter metrics in [start, end]
+def fetch_rate_series(connection, metric_names, start, end, resolution=None, scale=1, archive=None):
+    """Rates are multiplied by `scale` (8 for bits)."""
+    rows = fetch_rate_rows(connection, metric_names, start, end, resolution, archive=archive)
+    return collect_series(rows, metric_names, scale)
+
+
+# Function to read the rate of every interface of some counter metrics
+def fetch_interface_series(connection, metric_names, start, end, scale=1):
+    """Returns {metric_name: {"ip:port/ifIndex": Series}}."""
+    series = {name: {} for name in metric_names}
+    for r in fetch_series_rates(connection, metric_names, start, end):
+        key = f"{r.ip_port}/{r.if_index}"
+        if key not in series[r.metric_name]:
+            series[r.metric_name][key] = Series()
+        series[r.metric_name][key].add(r.t, r.rate * scale)
+    return series
+
+
+# Function to read many series of any metrics in one query
+def fetch_query_series(connection, metric_names, start, end, step, aggregate="avg", ip_ports=None,
+                       if_indexes=None, by="series", rates=True):
+    """
+    Returns {(metric_name, ip_port, if_index): (is_rate, Series)} over
+    [start, end) in `step` second buckets. `aggregate` (a key of
+    AGGREGATES) combines the points of one series in a bucket; with `by`
+    "device" or "metric" the bucket values of the series are then summed
+    per device or per metric, and the missing key parts are None.
+    No `ip_ports` / `if_indexes` means every device / interface.
+    """
+    device, interface = GROUPINGS[by]
+    sql = QUERY_SQL.format(aggregate=AGGREGATES[aggregate], device=device, interface=interface)
+    rows = connection.execute(text(sql), {
+        "metric_names": list(metric_names),
+        "ip_ports": list(ip_ports or []),
+        "any_device": not ip_ports,
+        "if_indexes": list(if_indexes or []),
+        "any_interface": not if_indexes,
+        "rates": rates,
+        "step": step,
+        "start": start,
+        "end": end,
+        "read_start": start - LOOKBACK,
+        "uptime_metric": UPTIME_METRIC,
+        "boot_low": start - LOOKBACK,
+        "boot_high": end,
+    })
+    series = {}
+    for metric_name, is_rate, ip_port, if_index, t, value in rows:
+        key = (metric_name, ip_port, if_index)
+        if key not in series:
+            series[key] = (is_rate, Series())
+        series[key][1].add(t, value)
+    return series
@@ -0,0 +1,143 @@
+# Counter-to-rate computation shared by the API and the rollup job.
+#
+# Deltas are taken per series, i.e. per (device, OID), with a LAG() window
+# so interfaces never get diffed against each other. A counter that went
+# backwards is either a wrap (added back modulo 2^32 or 2^64 depending on
+# its type) or an agent restart. Restarts are told apart with sysUpTime:
+# if the boot time an uptime sample implies (sample time - uptime) is later
+# than the previous counter sample, the agent rebooted in between and the
+# interval is dropped.
+from datetime import timedelta
+
+from sqlalchemy import text
+
+UPTIME_METRIC = "System Uptime"
+
+# How far before the window samples are read so its first point has a predecessor
+LOOKBACK = timedelta(minutes=10)
+
+COUNTER32_MODULUS = 2 ** 32
+COUNTER64_MODULUS = 2 ** 64
+
+# Default bucket width (seconds) for the aggregate series
+DEFAULT_STEP = 60
+
+# Boot time implied by every uptime sample between :boot_low and :boot_high
+BOOTS_CTE = """
+    boots AS (
+        SELECT s.device_id, s.timestamp,
+               s.timestamp - make_interval(secs => s.value / 100) AS boot_time
+        FROM snmp_samples s
+        JOIN snmp_metrics m ON m.metric_id = s.metric_id
+        WHERE m.metric_name = :uptime_metric
+          AND s.timestamp > :boot_low AND s.timestamp <= :boot_high
+    )
+"""
+
+# Delta between a sample and its predecessor in the same series, or NULL
+# when the interval spans an agent restart or the counter type is unknown.
+# Expects columns device_id, timestamp, value, prev_ts, prev_value and value_type.
+DELTA_EXPRESSION = f"""
+    CASE
+        WHEN EXISTS (
+            SELECT 1 FROM boots b
+            WHERE b.device_id = d.device_id
+              AND b.timestamp > d.prev_ts AND b.timestamp <= d.timestamp
+              AND b.boot_time > d.prev_ts
+        ) THEN NULL
+        WHEN d.value >= d.prev_value THEN d.value - d.prev_value
+        WHEN d.value_type = 'Counter32' THEN d.value + {COUNTER32_MODULUS}::double precision - d.prev_value
+        WHEN d.value_type = 'Counter64' THEN d.value + {COUNTER64_MODULUS}::double precision - d.prev_value
+    END
+"""
+
+
+# Function to apply the wrap rules above to one pair of samples in Python
+def counter_delta(value, prev_value, value_type):
+    """
+    Returns the increase from prev_value to value, or None if it is unknown.
+    Restarts are not checked here; that is up to the caller.
+    """
+    if value >= prev_value:
+        return value - prev_value
+    if value_type == "Counter32":
+        return value + COUNTER32_MODULUS - prev_value
+    if value_type == "Counter64":
+        return value + COUNTER64_MODULUS - prev_value
+    return None
+
+
+SERIES_RATES_SQL = f"""
+    WITH {BOOTS_CTE},
+    d AS (
+        SELECT s.device_id, s.metric_id, m.metric_name, m.if_index, m.value_type, s.timestamp, s.value,
+               LAG(s.value) OVER w AS prev_value,
+               LAG(s.timestamp) OVER w AS prev_ts
+        FROM snmp_samples s
+        JOIN snmp_metrics m ON m.metric_id = s.metric_id
+        WHERE m.metric_name = ANY(:metric_names)
+          AND s.timestamp >= :read_start AND s.timestamp <= :end
+        WINDOW w AS (PARTITION BY s.device_id, s.metric_id ORDER BY s.timestamp)
+    ),
+    rates AS (
+        SELECT d.device_id, d.metric_id, d.metric_name, d.if_index, d.timestamp,
+               ({DELTA_EXPRESSION}) / EXTRACT(EPOCH FROM d.timestamp - d.prev_ts) AS rate
+        FROM d
+        WHERE d.prev_ts IS NOT NULL AND d.timestamp > d.prev_ts AND d.timestamp >= :start
+    )
+"""
+
+
+def _params(metric_names, start, end):
+    return {
+        "metric_names": list(metric_names),
+        "uptime_metric": UPTIME_METRIC,
+        "start": start,
+        "end": end,
+        "read_start": start - LOOKBACK,
+        "boot_low": start - LOOKBACK,
+        "boot_high": end,
+    }
+
+
+# Function to compute the rate of every series of some metrics
+def fetch_series_rates(connection, metric_names, start, end):
+    """
+    Returns rows of (metric_name, ip_port, if_index, t, rate) in time order,
+    t in epoch seconds and rate in counter units per second.
+    """
+    return connection.execute(text(SERIES_RATES_SQL + """
+        SELECT r.metric_name, dev.ip_port, r.if_index,
+               FLOOR(EXTRACT(EPOCH FROM r.timestamp))::bigint AS t, r.rate
+        FROM rates r
+        JOIN snmp_devices dev ON dev.device_id = r.device_id
+        WHERE r.rate IS NOT NULL
+        ORDER BY r.timestamp
+    """), _params(metric_names, start, end)).all()
+
+
+# Function to compute the total rate of some metrics across all their series
+def fetch_aggregate_rates(connection, metric_names, start, end, step=DEFAULT_STEP, stream=False):
+    """
+    Returns rows of (metric_name, t, rate) ordered by metric and time: each
+    series is averaged over `step` second buckets and the bucket averages
+    are summed over all series of the metric. t is in epoch seconds.
+    With stream=True the rows come from a server-side cursor as they are read.
+    """
+    params = _params(metric_names, start, end)
+    params["step"] = step
+    result = connection.execute(text(SERIES_RATES_SQL + """
+        , buckets AS (
+            SELECT device_id, metric_id, metric_name,
+                   FLOOR(EXTRACT(EPOCH FROM timestamp) / :step)::bigint * :step AS t,
+                   AVG(rate) AS rate
+            FROM rates
+            WHERE rate IS NOT NULL
+            GROUP BY device_id, metric_id, metric_name, t
+        )
+        SELECT metric_name, t, SUM(rate) AS rate
+        FROM buckets
+        GROUP BY metric_name, t
+        ORDER BY metric_name, t
+    """).execution_options(stream_results=stream), params)
+    return result if stream else result.all()
@@ -0,0 +1,303 @@
+# Incremental rate rollups for counter metrics.
+#
+# Raw counter samples in snmp_samples are turned into per-series rates and
+# aggregated into 1-minute buckets, which are then folded into 5-minute and
+# 1-hour buckets. A watermark records how far the raw data has been
+# processed, so every run only reads samples newer than the last one.
+#
+# Run `python rollup.py` next to app.py to keep the rollups up to date.
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from rates import BOOTS_CTE, DELTA_EXPRESSION, LOOKBACK, UPTIME_METRIC
+
+# (name, bucket width in seconds), finest first
+RESOLUTIONS = [("1m", 60), ("5m", 300), ("1h", 3600)]
+
+# Samples newer than this are left for the next run, so rows that are
+# still being written are not skipped
+ROLLUP_GRACE = timedelta(minutes=2)
+
+# Largest slice of raw data processed in one transaction while catching up
+MAX_CATCHUP = timedelta(hours=6)
+
+# Seconds between runs when started as a script
+ROLLUP_INTERVAL = 60
+
+# A resolution is only used if the requested window holds at least this many buckets
+MIN_POINTS = 120
+
+WATERMARK_NAME = "raw"
+
+# Oldest sample the collector replayed from its spool since the last run,
+# written by writer_pj5.py; rollups already past it are redone from there
+REPLAY_WATERMARK_NAME = "replay"
+
+COUNTER_TYPES = ["Counter32", "Counter64"]
+
+# SQL expression for the start of the bucket a 1-minute bucket falls in
+BUCKET_EXPRESSIONS = {
+    "5m": "date_trunc('hour', bucket) + floor(date_part('minute', bucket) / 5) * interval '5 minutes'",
+    "1h": "date_trunc('hour', bucket)",
+}
+
+NEW_ROWS_SQL = """
+    CREATE TEMPORARY TABLE rollup_new_rows ON COMMIT DROP AS
+    SELECT s.metric_id, s.device_id, m.value_type, s.timestamp, s.value
+    FROM snmp_samples s
+    JOIN snmp_metrics m ON m.metric_id = s.metric_id
+    WHERE m.value_type = ANY(:counter_types)
+      AND s.timestamp > :low AND s.timestamp <= :high;
+"""
+
+# Rates between consecutive samples of one series; the last sample of the
+# previous run (snmp_rollup_state) seeds the first delta of this run.
+# Wraps and agent restarts are handled as in rates.py.
+ROLLUP_1M_SQL = f"""
+    WITH {BOOTS_CTE},
+    series AS (
+        SELECT st.metric_id, st.device_id, n.value_type, st.last_ts AS timestamp,
+               st.last_value AS value, TRUE AS seed
+        FROM snmp_rollup_state st
+        JOIN (SELECT DISTINCT metric_id, device_id, value_type FROM rollup_new_rows) n
+          ON n.metric_id = st.metric_id AND n.device_id = st.device_id
+        UNION ALL
+        SELECT metric_id, device_id, value_type, timestamp, value, FALSE AS seed FROM rollup_new_rows
+    ),
+    d AS (
+        SELECT metric_id, device_id, value_type, timestamp, value, seed,
+               LAG(value) OVER w AS prev_value,
+               LAG(timestamp) OVER w AS prev_ts
+        FROM series
+        WINDOW w AS (PARTITION BY metric_id, device_id ORDER BY timestamp)
+    ),
+    rates AS (
+        SELECT d.metric_id, d.device_id, d.timestamp,
+               ({DELTA_EXPRESSION}) / EXTRACT(EPOCH FROM d.timestamp - d.prev_ts) AS rate
+        FROM d
+        WHERE NOT d.seed AND d.prev_ts IS NOT NULL AND d.timestamp > d.prev_ts
+    )
+    INSERT INTO snmp_rollup_1m AS r
+        (metric_id, device_id, bucket, rate_sum, rate_count, rate_min, rate_max, rate_last, last_ts)
+    SELECT metric_id, device_id, date_trunc('minute', timestamp),
+           SUM(rate), COUNT(*), MIN(rate), MAX(rate),
+           (ARRAY_AGG(rate ORDER BY timestamp DESC))[1], MAX(timestamp)
+    FROM rates
+    WHERE rate IS NOT NULL
+    GROUP BY metric_id, device_id, date_trunc('minute', timestamp)
+    ON CONFLICT (metric_id, device_id, bucket) DO UPDATE SET
+        rate_sum = r.rate_sum + EXCLUDED.rate_sum,
+        rate_count = r.rate_count + EXCLUDED.rate_count,
+        rate_min = LEAST(r.rate_min, EXCLUDED.rate_min),
+        rate_max = GREATEST(r.rate_max, EXCLUDED.rate_max),
+        rate_last = CASE WHEN EXCLUDED.last_ts >= r.last_ts THEN EXCLUDED.rate_last ELSE r.rate_last END,
+        last_ts = GREATEST(r.last_ts, EXCLUDED.last_ts);
+"""
+
+UPDATE_STATE_SQL = """
+    INSERT INTO snmp_rollup_state AS st (metric_id, device_id, last_ts, last_value)
+    SELECT DISTINCT ON (metric_id, device_id) metric_id, device_id, timestamp, value
+    FROM rollup_new_rows
+    ORDER BY metric_id, device_id, timestamp DESC
+    ON CONFLICT (metric_id, device_id) DO UPDATE SET
+        last_ts = EXCLUDED.last_ts,
+        last_value = EXCLUDED.last_value
+    WHERE EXCLUDED.last_ts > st.last_ts;
+"""
+
+# Seeds of the series whose rollups are redone go back to their last sample
+# at or before the new watermark; older ones are left as they are
+REWIND_STATE_SQL = """
+    INSERT INTO snmp_rollup_state (metric_id, device_id, last_ts, last_value)
+    SELECT DISTINCT ON (s.metric_id, s.device_id) s.metric_id, s.device_id, s.timestamp, s.value
+    FROM snmp_samples s
+    JOIN snmp_metrics m ON m.metric_id = s.metric_id
+    WHERE m.value_type = ANY(:counter_types)
+      AND s.timestamp > :seed_low AND s.timestamp <= :low
+    ORDER BY s.metric_id, s.device_id, s.timestamp DESC
+    ON CONFLICT (metric_id, device_id) DO NOTHING;
+"""
+
+# Coarser buckets are rebuilt from the next finer table for the buckets
+# touched by this run; sum/count make the result exact.
+ROLLUP_COARSE_SQL = """
+    WITH source AS (
+        SELECT metric_id, device_id, {bucket_expression} AS bucket,
+               rate_sum, rate_count, rate_min, rate_max, rate_last, last_ts
+        FROM snmp_rollup_{source}
+        WHERE bucket >= {bucket_expression_low} AND bucket <= :high
+    )
+    INSERT INTO snmp_rollup_{target} AS r
+        (metric_id, device_id, bucket, rate_sum, rate_count, rate_min, rate_max, rate_last, last_ts)
+    SELECT metric_id, device_id, bucket,
+           SUM(rate_sum), SUM(rate_count), MIN(rate_min), MAX(rate_max),
+           (ARRAY_AGG(rate_last ORDER BY last_ts DESC))[1], MAX(last_ts)
+    FROM source
+    GROUP BY metric_id, device_id, bucket
+    ON CONFLICT (metric_id, device_id, bucket) DO UPDATE SET
+        rate_sum = EXCLUDED.rate_sum,
+        rate_count = EXCLUDED.rate_count,
+        rate_min = EXCLUDED.rate_min,
+        rate_max = EXCLUDED.rate_max,
+        rate_last = EXCLUDED.rate_last,
+        last_ts = EXCLUDED.last_ts;
+"""
+
+
+def get_watermark(connection):
+    return connection.execute(
+        text("SELECT watermark FROM snmp_rollup_watermark WHERE name = :name"),
+        {"name": WATERMARK_NAME}
+    ).scalar()
+
+
+def rewind(connection, low):
+    """
+    Takes the oldest sample replayed since the last run, if any. When the
+    watermark `low` is already past it, the 1-minute buckets from the one
+    it falls in are deleted and the watermark moves back to just before
+    that bucket, so the next steps roll them up again, replayed samples
+    included; coarser buckets are rebuilt by those steps. Returns the
+    watermark to continue from.
+    """
+    replayed = connection.execute(
+        text("DELETE FROM snmp_rollup_watermark WHERE name = :name RETURNING watermark"),
+        {"name": REPLAY_WATERMARK_NAME}
+    ).scalar()
+    if replayed is None or replayed > low:
+        return low
+
+    bucket = replayed.replace(second=0, microsecond=0)
+    low = bucket - timedelta(microseconds=1)
+    connection.execute(text("DELETE FROM snmp_rollup_1m WHERE bucket >= :bucket"), {"bucket": bucket})
+    connection.execute(text("DELETE FROM snmp_rollup_state WHERE last_ts > :low"), {"low": low})
+    connection.execute(text(REWIND_STATE_SQL), {
+        "counter_types": COUNTER_TYPES, "seed_low": low - LOOKBACK, "low": low,
+    })
+    print(f"Rolling up again from {bucket} for replayed samples")
+    return low
+
+
+def rollup_step(connection, low, high):
+    """Rolls up raw samples in (low, high] and moves the watermark to high."""
+    connection.execute(text(NEW_ROWS_SQL), {
+        "counter_types": COUNTER_TYPES, "low": low, "high": high,
+    })
+    connection.execute(text(ROLLUP_1M_SQL), {
+        "uptime_metric": UPTIME_METRIC, "boot_low": low - LOOKBACK, "boot_high": high,
+    })
+    connection.execute(text(UPDATE_STATE_SQL))
+
+    finer = "1m"
+    for resolution, _ in RESOLUTIONS[1:]:
+        expression = BUCKET_EXPRESSIONS[resolution]
+        connection.execute(text(ROLLUP_COARSE_SQL.format(
+            source=finer,
+            target=resolution,
+            bucket_expression=expression,
+            # first source bucket of the first target bucket touched by this run
+            bucket_expression_low=expression.replace("bucket", ":low"),
+        )), {"low": low, "high": high})
+        finer = resolution
+
+    connection.execute(text("""
+        INSERT INTO snmp_rollup_watermark (name, watermark) VALUES (:name, :high)
+        ON CONFLICT (name) DO UPDATE SET watermark = EXCLUDED.watermark;
+    """), {"name": WATERMARK_NAME, "high": high})
+
+
+# Function to bring every rollup up to date
+def run_rollups(engine):
+    """
+    Processes raw samples between the watermark and now minus ROLLUP_GRACE,
+    at most MAX_CATCHUP at a time, each slice in its own transaction. The
+    first one also rewinds for replayed samples (see rewind()).
+    Returns the new watermark.
+    """
+    with engine.connect() as connection:
+        low = get_watermark(connection)
+        high_limit = connection.execute(text("SELECT now() AT TIME ZONE 'UTC'")).scalar() - ROLLUP_GRACE
+        if low is None:
+            first = connection.execute(text("SELECT MIN(timestamp) FROM snmp_samples")).scalar()
+            if first is None:
+                return None
+            low = first - timedelta(seconds=1)
+
+    rewound = False
+    while True:
+        with engine.begin() as connection:
+            if not rewound:
+                low = rewind(connection, low)
+                rewound = True
+            if low >= high_limit:
+                break
+            high = min(low + MAX_CATCHUP, high_limit)
+            rollup_step(connection, low, high)
+        low = high
+    return low
+
+
+# Function to read the summed rate of some metrics from a rollup table
+def fetch_rollup_rates(connection, resolution, metric_names, start, end, stream=False):
+    """
+    Returns rows of (metric_name, t, rate) ordered by metric and bucket for
+    the buckets starting in [start, end], where t is the bucket start in
+    epoch seconds and rate the sum over all series of the metric of their
+    average rate (units per second).
+    With stream=True the rows come from a server-side cursor as they are read.
+    """
+    result = connection.execute(text(f"""
+        SELECT m.metric_name, FLOOR(EXTRACT(EPOCH FROM r.bucket))::bigint AS t,
+               SUM(r.rate_sum / r.rate_count) AS rate
+        FROM snmp_rollup_{resolution} r
+        JOIN snmp_metrics m ON m.metric_id = r.metric_id
+        WHERE m.metric_name = ANY(:metric_names) AND r.bucket >= :start AND r.bucket <= :end
+        GROUP BY m.metric_name, r.bucket
+        ORDER BY m.metric_name, r.bucket
+    """).execution_options(stream_results=stream), {
+        "metric_names": list(metric_names), "start": start, "end": end,
+    })
+    return result if stream else result.all()
+
+
+# Function to find the buckets a rollup table holds in full
+def rollup_coverage(connection, resolution):
+    """
+    Returns (first, end): every bucket starting in [first, end) is complete.
+    Buckets before `first` were never rolled up or have expired; the one
+    the watermark falls in is still filling. None when there is nothing.
+    """
+    watermark = get_watermark(connection)
+    first = connection.execute(text(f"SELECT MIN(bucket) FROM snmp_rollup_{resolution}")).scalar()
+    if watermark is None or first is None:
+        return None
+    width = dict(RESOLUTIONS)[resolution]
+    end = watermark.replace(tzinfo=timezone.utc).timestamp() // width * width
+    return first, datetime.fromtimestamp(end, timezone.utc).replace(tzinfo=None)
+
+
+# Function to pick the coarsest rollup that still gives enough points
+def pick_resolution(window):
+    """
+    Returns (name, seconds) of the coarsest resolution with at least
+    MIN_POINTS buckets in `window` (a timedelta), or None to use raw samples.
+    """
+    for name, seconds in reversed(RESOLUTIONS):
+        if window.total_seconds() / seconds >= MIN_POINTS:
+            return name, seconds
+    return None
+
+
+if __name__ == "__main__":
+    from app import app, db
+
+    with app.app_context():
+        while True:
+            try:
+                watermark = run_rollups(db.engine)
+                print(f"Rollups up to date through {watermark}")
+            except Exception as e:
+                print(f"Error running rollups: {e}")
+            time.sleep(ROLLUP_INTERVAL)
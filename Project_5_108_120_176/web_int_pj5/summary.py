@@ -0,0 +1,245 @@
+# Device summaries (name, description, memory) for the inventory page.
+#
+# A background scheduler polls every device in the collector's inventory
+# with one batched SNMP GET, a few devices at a time, and stores the result
+# in a versioned in-memory cache. Requests only ever read that cache, so a
+# slow or dead agent can never hold up a page.
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from pysnmp.hlapi import (
+    CommunityData,
+    ContextData,
+    EndOfMibView,
+    NoSuchInstance,
+    NoSuchObject,
+    ObjectIdentity,
+    ObjectType,
+    SnmpEngine,
+    UdpTransportTarget,
+    getCmd,
+)
+
+# The collector's device inventory
+INVENTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "devices.json")
+
+DEFAULT_PORT = 161
+DEFAULT_COMMUNITY = "public"
+
+# Seconds between refreshes of one device, and how far each one may drift
+# either way so devices do not all get polled at the same moment
+REFRESH_INTERVAL = 300
+REFRESH_JITTER = 0.1
+
+# One short try per refresh; a missed refresh is retried on the next one
+SNMP_TIMEOUT = 2
+SNMP_RETRIES = 0
+
+# Devices refreshed at the same time
+MAX_WORKERS = 8
+
+# A boot time this much later than the last one known means the device restarted
+REBOOT_TOLERANCE = 60
+
+# Seconds the scheduler sleeps when nothing is due
+SCHEDULER_TICK = 1
+
+SYS_DESCR = "1.3.6.1.2.1.1.1.0"
+SYS_UPTIME = "1.3.6.1.2.1.1.3.0"
+SYS_NAME = "1.3.6.1.2.1.1.5.0"
+# UCD-SNMP-MIB memTotalReal / memAvailReal, in kB
+MEM_TOTAL = "1.3.6.1.4.1.2021.4.5.0"
+MEM_AVAIL = "1.3.6.1.4.1.2021.4.6.0"
+
+SUMMARY_OIDS = [SYS_NAME, SYS_DESCR, SYS_UPTIME, MEM_TOTAL, MEM_AVAIL]
+
+MISSING_VALUE_TYPES = (NoSuchInstance, NoSuchObject, EndOfMibView)
+
+
+def load_devices(path=INVENTORY_FILE):
+    """Returns [(ip, port, community)] from the inventory, or the local agent."""
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return [("127.0.0.1", DEFAULT_PORT, DEFAULT_COMMUNITY)]
+    return [
+        (e["ip"], int(e.get("port", DEFAULT_PORT)), e.get("community", DEFAULT_COMMUNITY))
+        for e in entries
+    ]
+
+
+# Function to guess type, vendor and category from sysDescr
+def classify(system_description):
+    if "Windows" in system_description:
+        return "Windows Server", "Microsoft", "Server"
+    if "Linux" in system_description:
+        return "Linux Server", "net-snmp", "Server"
+    return "Unknown", "Unknown", "Unknown"
+
+
+def format_uptime(seconds):
+    if seconds is None:
+        return "N/A"
+    minutes, _ = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h {minutes}m"
+
+
+def format_memory(kilobytes):
+    return f"{int(kilobytes) / 1024:.2f} MB" if kilobytes is not None else "N/A"
+
+
+class DeviceProbe:
+    """SNMP engine and transport of one device, built once and reused."""
+
+    def __init__(self, ip, port, community):
+        self.ip = ip
+        self.port = port
+        self.engine = SnmpEngine()
+        self.auth = CommunityData(community)
+        self.transport = UdpTransportTarget((ip, port), timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES)
+        self.context = ContextData()
+
+    def fetch(self):
+        """All SUMMARY_OIDS in one GET. Returns {oid: str value}; raises on failure."""
+        error_indication, error_status, _, var_binds = next(getCmd(
+            self.engine, self.auth, self.transport, self.context,
+            *[ObjectType(ObjectIdentity(oid)) for oid in SUMMARY_OIDS],
+            lookupMib=False
+        ))
+        if error_indication:
+            raise RuntimeError(str(error_indication))
+        if error_status:
+            raise RuntimeError(error_status.prettyPrint())
+        return {
+            str(oid): value.prettyPrint()
+            for oid, value in var_binds
+            if not isinstance(value, MISSING_VALUE_TYPES)
+        }
+
+    def summary(self, values):
+        """
+        The summary fields that only change when the device does; uptime and
+        the refresh time are kept apart (see DeviceSummaryService).
+        """
+        system_description = values.get(SYS_DESCR, "N/A")
+        device_type, vendor, category = classify(system_description)
+        return {
+            "IP Address": self.ip,
+            "Port": self.port,
+            "DNS Name": values.get(SYS_NAME, "N/A"),
+            "System Description": system_description,
+            "Status": "Clear",
+            "Poll Using": "IP Address",
+            "Type": device_type,
+            "Vendor": vendor,
+            "Category": category,
+            "RAM size": format_memory(values.get(MEM_TOTAL)),
+            "Available RAM": format_memory(values.get(MEM_AVAIL)),
+            "Hard disk size": "N/A",
+            "Monitoring (mins)": str(REFRESH_INTERVAL // 60),
+            "Uplink Dependency": "None",
+            "Monitored via": "SNMP",
+        }
+
+
+class DeviceSummaryService:
+    """
+    Keeps a summary of every inventory device fresh in the background.
+    snapshot() never waits on SNMP.
+
+    Uptime and "Last Updated" change on every refresh, so they are stored
+    as the device's boot time and the refresh time and only filled in by
+    snapshot(); the version moves only when the rest of a summary changes
+    or the device restarted.
+    """
+
+    def __init__(self, devices, interval=REFRESH_INTERVAL, max_workers=MAX_WORKERS):
+        self.devices = devices
+        self.interval = interval
+        self.max_workers = max_workers
+        self.probes = {}
+        self.next_due = {}
+        self.in_flight = set()
+        self.summaries = {
+            f"{ip}:{port}": {"IP Address": ip, "Port": port, "Status": "Pending"}
+            for ip, port, _ in devices
+        }
+        # key -> epoch the device booted at, and -> datetime (UTC) of its last refresh
+        self.booted = {}
+        self.updated = {}
+        # Bumped on every change, so clients can tell whether they are up to date
+        self.version = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        self.thread = None
+
+    def start(self):
+        """Starts the scheduler once; later calls do nothing."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            # Spread the first refreshes over the first few seconds
+            now = time.monotonic()
+            for ip, port, community in self.devices:
+                key = f"{ip}:{port}"
+                self.probes[key] = DeviceProbe(ip, port, community)
+                self.next_due[key] = now + random.uniform(0, min(5, self.interval))
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="summary")
+            self.thread = threading.Thread(target=self._schedule, name="summary-scheduler", daemon=True)
+        self.thread.start()
+
+    def snapshot(self):
+        """Returns (version, [summary, ...]) in inventory order."""
+        now = time.time()
+        with self.lock:
+            summaries = []
+            for key, summary in self.summaries.items():
+                summary = dict(summary)
+                if key in self.updated:
+                    booted = self.booted.get(key)
+                    summary["Uptime"] = format_uptime(None if booted is None else now - booted)
+                    summary["Last Updated"] = self.updated[key].strftime('%Y-%m-%d %H:%M:%S')
+                summaries.append(summary)
+            return self.version, summaries
+
+    def _schedule(self):
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                due = [k for k, t in self.next_due.items() if t <= now and k not in self.in_flight]
+                self.in_flight.update(due)
+            for key in due:
+                self.executor.submit(self._refresh, key)
+            time.sleep(SCHEDULER_TICK)
+
+    def _refresh(self, key):
+        probe = self.probes[key]
+        booted = self.booted.get(key)
+        try:
+            values = probe.fetch()
+            summary = probe.summary(values)
+            if SYS_UPTIME in values:
+                booted = time.time() - int(values[SYS_UPTIME]) / 100
+        except Exception as e:
+            # Keep what was last known, but say the device is not answering
+            summary = dict(self.summaries[key], Status="Unreachable", Error=str(e))
+        jitter = random.uniform(-REFRESH_JITTER, REFRESH_JITTER) * self.interval
+        with self.lock:
+            known = self.booted.get(key)
+            restarted = booted is not None and (known is None or abs(booted - known) > REBOOT_TOLERANCE)
+            if summary != self.summaries[key] or restarted:
+                self.summaries[key] = summary
+                self.version += 1
+            if restarted:
+                self.booted[key] = booted
+            self.updated[key] = datetime.now(timezone.utc)
+            self.next_due[key] = time.monotonic() + self.interval + jitter
+            self.in_flight.discard(key)
@@ -0,0 +1,7 @@
+# Production entry point for the dashboard.
+#
+#     gunicorn -c gunicorn.conf.py wsgi:application
+#
+# app.py's app.run() is the Flask development server and serves one request
+# at a time; this module exposes the same app to a WSGI server instead.
+from app import app as application
@@ -0,0 +1,341 @@
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db_pj5 import create_partitions, list_partitions
+from stats_pj5 import CollectorStats
+
+# Flush once this many samples are buffered...
+FLUSH_ROWS = 1000
+# ...or once the oldest buffered sample is this many seconds old
+FLUSH_INTERVAL = 5.0
+# Most samples held in memory; beyond this new samples go to the spool
+MAX_PENDING = 50000
+# Spooled samples written back per batch once the database is reachable
+REPLAY_ROWS = 5000
+# Seconds before the first reconnect attempt, doubled on every failure up to the max
+RECONNECT_MIN = 1.0
+RECONNECT_MAX = 60.0
+
+INSERT_QUERY = """
+    INSERT INTO snmp_samples (metric_id, device_id, timestamp, value)
+    VALUES %s;
+"""
+
+DEVICE_QUERY = """
+    INSERT INTO snmp_devices (ip_port) VALUES (%s)
+    ON CONFLICT (ip_port) DO UPDATE SET ip_port = EXCLUDED.ip_port
+    RETURNING device_id;
+"""
+
+# Newest collection time per device in the batch; never moves backwards
+LAST_SAMPLE_QUERY = """
+    UPDATE snmp_devices AS d SET last_sample = GREATEST(d.last_sample, v.last_sample)
+    FROM (VALUES %s) AS v (device_id, last_sample)
+    WHERE d.device_id = v.device_id;
+"""
+
+# Delivered on commit; the web app's hot window listens for it
+NOTIFY_QUERY = "NOTIFY snmp_ingest;"
+
+# Replayed samples are older than what the rollups and the hot window have
+# already read: the oldest one is recorded for web_int_pj5/rollup.py to roll
+# up again from (it only ever moves back), and sent as the payload of the
+# notification so the hot window re-reads from there
+REPLAY_WATERMARK_QUERY = """
+    INSERT INTO snmp_rollup_watermark AS w (name, watermark) VALUES ('replay', %s)
+    ON CONFLICT (name) DO UPDATE SET watermark = LEAST(w.watermark, EXCLUDED.watermark);
+"""
+REPLAY_NOTIFY_QUERY = "SELECT pg_notify('snmp_ingest', %s);"
+
+METRIC_QUERY = """
+    INSERT INTO snmp_metrics (metric_name, oid, if_index, value_type) VALUES (%s, %s, %s, %s)
+    ON CONFLICT (oid) DO UPDATE SET metric_name = EXCLUDED.metric_name
+    RETURNING metric_id;
+"""
+
+# Marks the end of the queue when the writer is closed
+_STOP = object()
+
+# Errors that mean the database is unreachable rather than the batch being bad
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class MetricWriter:
+    """
+    Write-behind buffer for collected samples. Samples are queued by the
+    poller and a background thread inserts them in multi-row batches, one
+    transaction per batch, on connections taken from `pool`.
+
+    When PostgreSQL is down or falls behind, samples go to `spool` on local
+    disk instead of blocking the poller: batches that fail are spooled and
+    the writer backs off before trying again, and samples that do not fit
+    the in-memory queue are spooled directly. Once a batch gets through,
+    the spool is written back in bulk between live batches. Without a
+    spool, write() blocks when the queue is full and failed batches are
+    dropped.
+    """
+
+    def __init__(self, pool, spool=None, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL,
+                 max_pending=MAX_PENDING, stats=None):
+        self.pool = pool
+        self.spool = spool
+        self.stats = stats or CollectorStats()
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_pending)
+        # ip_port -> device_id and oid -> metric_id, filled on first sight
+        self.device_ids = {}
+        self.metric_ids = {}
+        # No database writes are tried before retry_at (monotonic)
+        self.retry_at = 0.0
+        self.backoff = 0.0
+        if spool is not None:
+            self.stats.set_spool_pending(len(spool))
+            if len(spool):
+                print(f"Replaying {len(spool)} spooled sample(s) from {spool.path}")
+        self.thread = threading.Thread(target=self._run, name="metric-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, sample):
+        try:
+            self.queue.put_nowait(sample)
+        except queue.Full:
+            if self.spool is not None:
+                self._spool([sample])
+                return
+            print(f"Write buffer full ({self.queue.maxsize} samples); waiting for the database")
+            started = time.monotonic()
+            self.queue.put(sample)
+            print(f"Write buffer drained after {time.monotonic() - started:.2f}s")
+
+    def write_many(self, samples):
+        for sample in samples:
+            self.write(sample)
+
+    def close(self):
+        """Flushes everything still buffered and stops the writer thread."""
+        self.queue.put(_STOP)
+        self.thread.join()
+        if self.spool is not None:
+            if len(self.spool):
+                print(f"{len(self.spool)} sample(s) left in {self.spool.path}; they are replayed on the next start")
+            self.spool.close()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if self.spool is not None and len(self.spool):
+                # Wake up to replay the spool as soon as the database may be back
+                wait = max(0.0, self.retry_at - time.monotonic())
+                timeout = wait if timeout is None else min(timeout, wait)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if batch and (len(batch) >= self.flush_rows or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+            # Live samples go first; the spool is replayed while the queue is short
+            if (self.spool is not None and len(self.spool) and time.monotonic() >= self.retry_at
+                    and self.queue.qsize() < self.flush_rows):
+                self._replay()
+
+    def _resolve_keys(self, connection, batch):
+        """Looks up (or creates) the dimension rows for unseen devices and OIDs."""
+        new_devices = {s.ip_port for s in batch if s.ip_port not in self.device_ids}
+        new_metrics = {s.oid: s for s in batch if s.oid not in self.metric_ids}
+        if not new_devices and not new_metrics:
+            return
+
+        device_ids = {}
+        metric_ids = {}
+        cursor = connection.cursor()
+        for ip_port in new_devices:
+            cursor.execute(DEVICE_QUERY, (ip_port,))
+            device_ids[ip_port] = cursor.fetchone()[0]
+        for oid, s in new_metrics.items():
+            cursor.execute(METRIC_QUERY, (s.metric_name, oid, s.if_index, s.value_type))
+            metric_ids[oid] = cursor.fetchone()[0]
+        connection.commit()
+        cursor.close()
+
+        # Only cache keys once they are committed
+        self.device_ids.update(device_ids)
+        self.metric_ids.update(metric_ids)
+
+    def _insert(self, batch, replayed=False):
+        """Writes one batch in one transaction; raises if it did not commit."""
+        connection = self.pool.getconn()
+        try:
+            self._resolve_keys(connection, batch)
+
+            rows = []
+            last_sample = {}
+            skipped = 0
+            for s in batch:
+                try:
+                    value = float(s.value)
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                # Samples carry the time the agent was read; insert time is only a fallback.
+                # Stored as naive UTC, which is how the dashboards read them back
+                timestamp = datetime.fromtimestamp(s.timestamp or time.time(), timezone.utc).replace(tzinfo=None)
+                device_id = self.device_ids[s.ip_port]
+                rows.append((self.metric_ids[s.oid], device_id, timestamp, value))
+                last_sample[device_id] = max(timestamp, last_sample.get(device_id, timestamp))
+
+            cursor = connection.cursor()
+            if rows:
+                execute_values(cursor, INSERT_QUERY, rows, page_size=len(rows))
+                execute_values(cursor, LAST_SAMPLE_QUERY, list(last_sample.items()))
+                if replayed:
+                    oldest = min(row[2] for row in rows)
+                    cursor.execute(REPLAY_WATERMARK_QUERY, (oldest,))
+                    cursor.execute(REPLAY_NOTIFY_QUERY, (oldest.isoformat(),))
+                else:
+                    cursor.execute(NOTIFY_QUERY)
+            connection.commit()
+            cursor.close()
+        except Exception:
+            self._discard(connection)
+            raise
+        self.pool.putconn(connection)
+        self.backoff = 0.0
+        self.stats.add(inserted=len(rows), skipped=skipped)
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        if self.spool is not None and time.monotonic() < self.retry_at:
+            self._spool(batch)
+            return
+        try:
+            self._insert(batch)
+        except Exception as e:
+            print(f"Error inserting data: {e}")
+            self._back_off()
+            if self.spool is not None:
+                self._spool(batch)
+            else:
+                self.stats.add(failed=len(batch))
+
+    def _discard(self, connection):
+        """Rolls back and returns a connection after an error; a broken one is closed."""
+        try:
+            connection.rollback()
+            self.pool.putconn(connection)
+        except Exception:
+            self.pool.putconn(connection, close=True)
+
+    def _replay(self):
+        ids, batch = self.spool.peek(REPLAY_ROWS)
+        if not batch:
+            return
+        try:
+            kept_ids, kept = self._partitioned(ids, batch)
+            if kept:
+                self._replay_rows(kept_ids, kept)
+            # Also acks samples left out at the end of the batch
+            self.spool.ack(ids[-1])
+        except CONNECTION_ERRORS as e:
+            print(f"Error replaying spooled samples: {e}")
+            self._back_off()
+        self.stats.set_spool_pending(len(self.spool))
+
+    def _partitioned(self, ids, batch):
+        """
+        Returns the (ids, samples) of a replay batch that have a partition
+        to go to: samples from before the oldest partition (already expired)
+        are dropped here rather than rejected one by one, and partitions
+        missing for later days are created.
+        """
+        connection = self.pool.getconn()
+        try:
+            cursor = connection.cursor()
+            days = {day for _, day in list_partitions(cursor)}
+            oldest = min(days, default=None)
+            kept_ids, kept, missing = [], [], set()
+            for row_id, s in zip(ids, batch):
+                day = datetime.fromtimestamp(s.timestamp or time.time(), timezone.utc).date()
+                if oldest is not None and day < oldest:
+                    continue
+                if day not in days:
+                    missing.add(day)
+                kept_ids.append(row_id)
+                kept.append(s)
+            for day in sorted(missing):
+                create_partitions(cursor, day, day)
+            connection.commit()
+            cursor.close()
+        except Exception as e:
+            self._discard(connection)
+            if isinstance(e, CONNECTION_ERRORS):
+                raise
+            # Replay them all; samples without a partition are then rejected one by one
+            print(f"Error checking partitions for spooled samples: {e}")
+            return ids, batch
+        self.pool.putconn(connection)
+
+        expired = len(batch) - len(kept)
+        if expired:
+            print(f"Dropping {expired} spooled sample(s) from before the oldest partition ({oldest})")
+            self.stats.add(failed=expired)
+        return kept_ids, kept
+
+    def _replay_rows(self, ids, batch):
+        """
+        Writes spooled samples back and acks them. A batch the database
+        rejects is retried in halves down to single samples, so only the
+        samples it rejects are dropped; keeping them would stop the whole
+        spool behind them.
+        """
+        try:
+            self._insert(batch, replayed=True)
+        except CONNECTION_ERRORS:
+            raise
+        except Exception as e:
+            if len(batch) > 1:
+                half = len(batch) // 2
+                self._replay_rows(ids[:half], batch[:half])
+                self._replay_rows(ids[half:], batch[half:])
+                return
+            print(f"Dropping a spooled sample the database rejected ({batch[0].ip_port} {batch[0].oid}): {e}")
+            self.stats.add(failed=1)
+        else:
+            self.stats.add(replayed=len(batch))
+        # Halves are written in spool order, so everything up to here is done
+        self.spool.ack(ids[-1])
+
+    def _spool(self, samples):
+        try:
+            self.spool.append(samples)
+        except Exception as e:
+            print(f"Error spooling samples: {e}")
+            self.stats.add(failed=len(samples))
+            return
+        self.stats.add(spooled=len(samples))
+        self.stats.set_spool_pending(len(self.spool))
+
+    def _back_off(self):
+        self.backoff = min(RECONNECT_MAX, max(RECONNECT_MIN, self.backoff * 2))
+        self.retry_at = time.monotonic() + self.backoff
+        print(f"Database unavailable; retrying in {self.backoff:.0f}s")